@@ -9,14 +9,37 @@ Also provides MFCC extraction for speech comparison in the mobile app.
 
 import os
 import io
+import csv
+import json
+import asyncio
 import base64
+import hashlib
+import math
+import random
+import re
+import secrets
+import sqlite3
+import sys
+import tarfile
+import tempfile
 import time
-from typing import Optional, List
-from fastapi import FastAPI, HTTPException
+import unicodedata
+import wave
+import zipfile
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, List, Tuple
+from xml.sax.saxutils import escape as xml_escape
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import httpx
 import numpy as np
+import orjson
 
 # MFCC extraction imports (lazy loaded for faster startup)
 librosa = None
@@ -38,16 +61,58 @@ def get_soundfile():
         sf = _sf
     return sf
 
+# Binary response encodings (lazy loaded, most clients speak JSON)
+msgpack = None
+cbor2 = None
+
+def get_msgpack():
+    """Lazy load msgpack."""
+    global msgpack
+    if msgpack is None:
+        import msgpack as _msgpack
+        msgpack = _msgpack
+    return msgpack
+
+def get_cbor2():
+    """Lazy load cbor2."""
+    global cbor2
+    if cbor2 is None:
+        import cbor2 as _cbor2
+        cbor2 = _cbor2
+    return cbor2
+
 # ═══════════════════════════════════════════════════════════
 # CONFIGURATION
 # ═══════════════════════════════════════════════════════════
 
 def get_azure_config():
-    """Get Azure Speech config from environment."""
+    """Get Azure Speech config from environment (primary region)."""
     key = os.getenv("AZURE_SPEECH_KEY")
     region = os.getenv("AZURE_SPEECH_REGION", "germanywestcentral")
     return key, region
 
+def get_azure_regions():
+    """
+    Get all (key, region) pairs to route between.
+    
+    AZURE_SPEECH_REGIONS is a comma-separated region list; AZURE_SPEECH_KEYS
+    holds one key per region (or a single key used everywhere). Without
+    them this is just the primary region from get_azure_config().
+    """
+    regions = [r.strip() for r in os.getenv("AZURE_SPEECH_REGIONS", "").split(",") if r.strip()]
+    if not regions:
+        key, region = get_azure_config()
+        return [(key, region)] if key else []
+    keys = [k.strip() for k in os.getenv("AZURE_SPEECH_KEYS", "").split(",") if k.strip()]
+    if not keys and os.getenv("AZURE_SPEECH_KEY"):
+        keys = [os.getenv("AZURE_SPEECH_KEY")]
+    if len(keys) == 1:
+        keys = keys * len(regions)
+    if len(keys) != len(regions):
+        print(f"[CONFIG] AZURE_SPEECH_KEYS has {len(keys)} keys for {len(regions)} regions")
+        return []
+    return list(zip(keys, regions))
+
 # Available voices
 VOICES = {
     "xiaoxiao": {
@@ -89,6 +154,523 @@ VOICES = {
 
 DEFAULT_VOICE = "xiaoxiao"
 
+# Outbound HTTP pool to Azure (one client for the whole app lifetime)
+HTTP2_ENABLED = os.getenv("AZURE_HTTP2", "1") != "0"
+HTTP_MAX_CONNECTIONS = int(os.getenv("AZURE_HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("AZURE_HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AZURE_HTTP_KEEPALIVE_EXPIRY", 60.0))
+HTTP_TIMEOUT = float(os.getenv("AZURE_HTTP_TIMEOUT", 30.0))
+
+# Bearer-token auth (tokens are valid for 10 minutes; refreshed in the background)
+AZURE_TOKEN_AUTH = os.getenv("AZURE_TOKEN_AUTH", "1") != "0"
+AZURE_TOKEN_ENDPOINT = os.getenv("AZURE_TOKEN_ENDPOINT")  # Override, e.g. a local stand-in
+AZURE_TOKEN_TTL = 600.0
+AZURE_TOKEN_REFRESH_SECONDS = float(os.getenv("AZURE_TOKEN_REFRESH_SECONDS", 480.0))
+
+# Retries for transient Azure failures (timeouts, 5xx, 429)
+AZURE_RETRIES = int(os.getenv("AZURE_RETRIES", 2))
+AZURE_RETRY_BASE_MS = float(os.getenv("AZURE_RETRY_BASE_MS", 100))
+AZURE_RETRY_MAX_MS = float(os.getenv("AZURE_RETRY_MAX_MS", 2000))
+AZURE_RETRY_AFTER_MAX = float(os.getenv("AZURE_RETRY_AFTER_MAX", 5.0))  # Give up if Azure asks for longer
+
+# Hedged requests: a second attempt after the p95 latency, first response wins
+AZURE_HEDGE = os.getenv("AZURE_HEDGE", "0") == "1"
+AZURE_HEDGE_MIN_DELAY_MS = float(os.getenv("AZURE_HEDGE_MIN_DELAY_MS", 150))
+AZURE_HEDGE_MAX_RATIO = float(os.getenv("AZURE_HEDGE_MAX_RATIO", 0.1))  # Cap on extra spend
+
+# Circuit breaker: after repeated Azure failures serve from cache only
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30.0))
+
+# Adaptive (AIMD) limit on concurrent outbound Azure calls
+AZURE_LIMIT_INITIAL = float(os.getenv("AZURE_LIMIT_INITIAL", 20))
+AZURE_LIMIT_MIN = float(os.getenv("AZURE_LIMIT_MIN", 2))
+AZURE_LIMIT_MAX = float(os.getenv("AZURE_LIMIT_MAX", 200))
+AZURE_LIMIT_BACKOFF = float(os.getenv("AZURE_LIMIT_BACKOFF", 0.7))  # Multiplier on overload
+AZURE_QUEUE_MAX = int(os.getenv("AZURE_QUEUE_MAX", 100))
+AZURE_QUEUE_TIMEOUT = float(os.getenv("AZURE_QUEUE_TIMEOUT", 2.0))
+
+# Request deadlines: clients send X-Request-Deadline-Ms (remaining budget);
+# otherwise these per-endpoint defaults apply
+DEADLINE_MAX_MS = float(os.getenv("DEADLINE_MAX_MS", 60000))
+ENDPOINT_DEADLINES_MS = {
+    "/synthesize": float(os.getenv("DEADLINE_SYNTHESIZE_MS", 5000)),
+    "/synthesize/stream": float(os.getenv("DEADLINE_STREAM_MS", 5000)),  # Until the first byte
+    "/synthesize/batch": float(os.getenv("DEADLINE_BATCH_MS", 20000)),
+}
+
+# Multi-region routing
+REGION_EWMA_ALPHA = float(os.getenv("REGION_EWMA_ALPHA", 0.2))
+REGION_DEMOTE_FAILURES = int(os.getenv("REGION_DEMOTE_FAILURES", 3))  # Consecutive failures
+REGION_DEMOTE_ERROR_RATE = float(os.getenv("REGION_DEMOTE_ERROR_RATE", 0.5))
+REGION_PROBE_INTERVAL = float(os.getenv("REGION_PROBE_INTERVAL", 15.0))
+
+# Output formats clients can ask for. "azure" is the X-Microsoft-OutputFormat
+# value and is part of every cache key, so each format is cached separately.
+OUTPUT_FORMATS = {
+    "mp3": {
+        "azure": "audio-16khz-128kbitrate-mono-mp3",
+        "ext": "mp3",
+        "mediaType": "audio/mpeg",
+    },
+    "mp3-32k": {
+        "azure": "audio-16khz-32kbitrate-mono-mp3",
+        "ext": "mp3",
+        "mediaType": "audio/mpeg",
+    },
+    "mp3-48k": {
+        "azure": "audio-24khz-48kbitrate-mono-mp3",
+        "ext": "mp3",
+        "mediaType": "audio/mpeg",
+    },
+    "opus-16k": {
+        "azure": "ogg-16khz-16bit-mono-opus",
+        "ext": "ogg",
+        "mediaType": "audio/ogg",
+    },
+    "opus-24k": {
+        "azure": "ogg-24khz-16bit-mono-opus",
+        "ext": "ogg",
+        "mediaType": "audio/ogg",
+    },
+    "wav": {
+        "azure": "riff-16khz-16bit-mono-pcm",
+        "ext": "wav",
+        "mediaType": "audio/wav",
+    },
+    "pcm": {
+        "azure": "raw-16khz-16bit-mono-pcm",
+        "ext": "pcm",
+        "mediaType": "audio/L16;rate=16000;channels=1",
+    },
+}
+
+DEFAULT_FORMAT = "mp3"
+DEFAULT_OUTPUT_FORMAT = OUTPUT_FORMATS[DEFAULT_FORMAT]["azure"]
+
+# Media type per file extension (for /audio/{key}.{ext})
+EXTENSION_MEDIA_TYPES = {spec["ext"]: spec["mediaType"] for spec in OUTPUT_FORMATS.values()}
+AZURE_FORMAT_EXTENSIONS = {spec["azure"]: spec["ext"] for spec in OUTPUT_FORMATS.values()}
+
+# Accept header media types -> format (first match wins)
+ACCEPT_FORMATS = [
+    ("audio/ogg", "opus-24k"),
+    ("audio/opus", "opus-24k"),
+    ("audio/mpeg", DEFAULT_FORMAT),
+    ("audio/mp3", DEFAULT_FORMAT),
+    ("audio/wav", "wav"),
+    ("audio/x-wav", "wav"),
+    ("audio/l16", "pcm"),
+]
+
+# In-memory audio cache budget (total bytes of audio, not entry count)
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Share of the cache kept as an LRU admission window for new clips (W-TinyLFU)
+AUDIO_CACHE_WINDOW_RATIO = float(os.getenv("AUDIO_CACHE_WINDOW_RATIO", 0.01))
+
+# Persistent audio store shared by all workers (set to "" to disable)
+AUDIO_STORE_DIR = os.getenv("AUDIO_STORE_DIR", "audio_store")
+
+# Prefix for audio URLs returned by /synthesize (e.g. a CDN origin); relative if empty
+AUDIO_BASE_URL = os.getenv("AUDIO_BASE_URL", "").rstrip("/")
+
+# /synthesize/batch limits
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+# Micro-batching: pack bulk cache misses into one multi-word Azure request
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "1") != "0"
+MICROBATCH_WINDOW_MS = float(os.getenv("MICROBATCH_WINDOW_MS", 20))
+MICROBATCH_MAX_WORDS = int(os.getenv("MICROBATCH_MAX_WORDS", 16))
+MICROBATCH_MAX_CHARS = int(os.getenv("MICROBATCH_MAX_CHARS", 300))
+MICROBATCH_BREAK_MS = int(os.getenv("MICROBATCH_BREAK_MS", 400))
+
+# Admin endpoints (cache prewarming) are disabled unless a token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", 4))
+
+# Speculative prefetch of upcoming lesson words (low priority)
+PREFETCH_MAX_ITEMS = int(os.getenv("PREFETCH_MAX_ITEMS", 30))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", 2))
+PREFETCH_RATE = float(os.getenv("PREFETCH_RATE", 10.0))  # Azure calls per second, all clients
+PREFETCH_HEADROOM = float(os.getenv("PREFETCH_HEADROOM", 0.5))  # Max share of the Azure limit in use
+PREFETCH_MAX_WAIT = float(os.getenv("PREFETCH_MAX_WAIT", 10.0))  # Give up on words after waiting this long
+
+# Durable deck-generation jobs (SQLite, shared by all workers)
+DECK_DB_PATH = os.getenv("DECK_DB_PATH", os.path.join(AUDIO_STORE_DIR or ".", "decks.sqlite3"))
+DECK_WORKERS = int(os.getenv("DECK_WORKERS", 2))
+DECK_MAX_ITEMS = int(os.getenv("DECK_MAX_ITEMS", 1000))
+DECK_MAX_ATTEMPTS = int(os.getenv("DECK_MAX_ATTEMPTS", 3))
+DECK_CLAIM_TIMEOUT = float(os.getenv("DECK_CLAIM_TIMEOUT", 120.0))  # Reclaim items from crashed workers
+
+# ═══════════════════════════════════════════════════════════
+# HTTP CLIENT
+# ═══════════════════════════════════════════════════════════
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled keep-alive client used for all Azure calls."""
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("[HTTP] h2 not installed, falling back to HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=limits,
+        timeout=HTTP_TIMEOUT,
+        headers={"User-Agent": "HanziMasterTTS"},
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared client (created on first use if startup hasn't run)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+# ═══════════════════════════════════════════════════════════
+# AZURE AUTH
+# ═══════════════════════════════════════════════════════════
+
+class AzureTokenManager:
+    """
+    Caches an Azure bearer token from the issueToken endpoint.
+    
+    A background task refreshes the token well before it expires, so the
+    synthesis hot path only ever reads the cached value. If no valid token
+    is available, callers fall back to the subscription key header.
+    """
+
+    def __init__(self, key: str, region: str, endpoint: Optional[str] = None):
+        self.key = key
+        self.region = region
+        self.endpoint = endpoint or f"https://{region}.api.cognitive.microsoft.com/sts/v1.0/issueToken"
+        self.refreshes = 0
+        self.failures = 0
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def token(self) -> Optional[str]:
+        """The cached token, or None if missing or about to expire."""
+        if self._token and time.monotonic() < self._expires_at - 30:
+            return self._token
+        return None
+
+    def invalidate(self) -> None:
+        self._token = None
+        self._expires_at = 0.0
+
+    async def refresh(self, force: bool = False) -> Optional[str]:
+        """Fetch a new token (concurrent callers share one fetch)."""
+        async with self._lock:
+            if self.token and not force:
+                return self._token
+            try:
+                response = await get_http_client().post(
+                    self.endpoint,
+                    headers={"Ocp-Apim-Subscription-Key": self.key},
+                    timeout=10.0,
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                self.failures += 1
+                print(f"[AUTH] Token refresh failed for {self.region}: {e}")
+                return None
+            self._token = response.text.strip()
+            self._expires_at = time.monotonic() + AZURE_TOKEN_TTL
+            self.refreshes += 1
+            return self._token
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            # The old token stays in use until the new one arrives
+            token = await self.refresh(force=True)
+            await asyncio.sleep(AZURE_TOKEN_REFRESH_SECONDS if token else 15.0)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def auth_headers(self) -> Dict[str, str]:
+        """Authorization header for a synthesis call."""
+        if AZURE_TOKEN_AUTH:
+            token = self.token
+            if token is None and self._task is None:
+                # No background refresher (e.g. lifespan not run): fetch inline
+                token = await self.refresh()
+            if token:
+                return {"Authorization": f"Bearer {token}"}
+        return {"Ocp-Apim-Subscription-Key": self.key}
+
+    def stats(self) -> dict:
+        return {
+            "region": self.region,
+            "hasToken": self.token is not None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+_token_managers: Dict[Tuple[str, str], AzureTokenManager] = {}
+
+def get_token_manager(key: str, region: str) -> AzureTokenManager:
+    """One token manager per (key, region), shared by the whole pool."""
+    manager = _token_managers.get((key, region))
+    if manager is None:
+        manager = AzureTokenManager(key, region, AZURE_TOKEN_ENDPOINT)
+        _token_managers[(key, region)] = manager
+    return manager
+
+
+# ═══════════════════════════════════════════════════════════
+# REGION ROUTING
+# ═══════════════════════════════════════════════════════════
+
+class RegionState:
+    """Health and latency of one Azure region."""
+
+    def __init__(self, key: str, region: str, order: int):
+        self.key = key
+        self.region = region
+        self.order = order  # Position in config, used as a tie-breaker
+        self.ewma_latency: Optional[float] = None  # Synthesis latency only; drives choose()
+        self.probe_latency: Optional[float] = None  # Voice-list probe RTT, for stats only
+        self.ewma_error = 0.0
+        self.consecutive_failures = 0
+        self.demoted = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def endpoint(self) -> str:
+        return f"https://{self.region}.tts.speech.microsoft.com/cognitiveservices/v1"
+
+    def score(self, prior: float = 0.0) -> Tuple[float, int]:
+        # Unmeasured regions borrow the best known latency, so a clean one
+        # ties with the best and gets measured, while one that only ever
+        # failed ranks behind it. Errors also add a flat penalty, so a
+        # failing region loses even when latencies are near zero.
+        latency = self.ewma_latency if self.ewma_latency is not None else prior
+        return latency * (1 + 4 * self.ewma_error) + self.ewma_error, self.order
+
+    def stats(self) -> dict:
+        return {
+            "region": self.region,
+            "demoted": self.demoted,
+            "ewmaLatencyMs": int(self.ewma_latency * 1000) if self.ewma_latency is not None else None,
+            "probeMs": int(self.probe_latency * 1000) if self.probe_latency is not None else None,
+            "errorRate": round(self.ewma_error, 3),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class RegionRouter:
+    """
+    Sends each request to the healthy region with the best EWMA latency.
+    
+    Regions that keep failing are demoted and skipped until a background
+    probe sees them answer again. If every region is demoted we still try
+    the best of them rather than fail outright.
+    """
+
+    def __init__(self, regions: List[Tuple[str, str]]):
+        self.regions = [RegionState(key, region, i) for i, (key, region) in enumerate(regions)]
+        self._task: Optional[asyncio.Task] = None
+
+    def choose(self, exclude: Tuple[str, ...] = ()) -> Optional[RegionState]:
+        candidates = [r for r in self.regions if r.region not in exclude] or self.regions
+        healthy = [r for r in candidates if not r.demoted] or candidates
+        if not healthy:
+            return None
+        known = [r.ewma_latency for r in self.regions if r.ewma_latency is not None]
+        prior = min(known) if known else 0.0
+        return min(healthy, key=lambda r: r.score(prior))
+
+    def _observe_latency(self, state: RegionState, seconds: float) -> None:
+        if state.ewma_latency is None:
+            state.ewma_latency = seconds
+        else:
+            state.ewma_latency += REGION_EWMA_ALPHA * (seconds - state.ewma_latency)
+
+    def record_success(self, state: RegionState, seconds: Optional[float] = None) -> None:
+        state.requests += 1
+        state.consecutive_failures = 0
+        state.ewma_error *= 1 - REGION_EWMA_ALPHA
+        if seconds is not None:
+            self._observe_latency(state, seconds)
+
+    def record_failure(self, state: RegionState) -> None:
+        state.requests += 1
+        state.failures += 1
+        state.consecutive_failures += 1
+        state.ewma_error += REGION_EWMA_ALPHA * (1 - state.ewma_error)
+        if not state.demoted and len(self.regions) > 1 and (
+            state.consecutive_failures >= REGION_DEMOTE_FAILURES
+            or state.ewma_error >= REGION_DEMOTE_ERROR_RATE
+        ):
+            state.demoted = True
+            print(f"[REGION] Demoted {state.region} after {state.consecutive_failures} failures")
+
+    async def probe(self, state: RegionState) -> None:
+        """
+        Check a region with a cheap request to its voice list (headers only).
+        
+        A successful probe restores a demoted region. Its round trip is kept
+        apart from the synthesis EWMA: a GET is far cheaper than a synthesis,
+        so mixing them would make probed regions look faster than they are.
+        """
+        url = f"https://{state.region}.tts.speech.microsoft.com/cognitiveservices/voices/list"
+        start_time = time.monotonic()
+        try:
+            client = get_http_client()
+            request = client.build_request(
+                "GET", url, headers={"Ocp-Apim-Subscription-Key": state.key}, timeout=5.0
+            )
+            response = await client.send(request, stream=True)
+            await response.aclose()
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            state.probe_latency = time.monotonic() - start_time
+            state.consecutive_failures = 0
+            state.ewma_error *= 1 - REGION_EWMA_ALPHA
+            if state.demoted:
+                state.demoted = False
+                state.ewma_error = min(state.ewma_error, REGION_DEMOTE_ERROR_RATE / 2)
+                print(f"[REGION] Restored {state.region}")
+
+    async def _probe_loop(self) -> None:
+        # First pass checks every region; afterwards only demoted ones get
+        # probed (healthy regions are measured by real traffic).
+        await asyncio.gather(*(self.probe(r) for r in self.regions))
+        while True:
+            await asyncio.sleep(REGION_PROBE_INTERVAL)
+            targets = [r for r in self.regions if r.demoted]
+            await asyncio.gather(*(self.probe(r) for r in targets))
+
+    def start(self) -> None:
+        if self._task is None and len(self.regions) > 1:
+            self._task = asyncio.ensure_future(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> List[dict]:
+        return [r.stats() for r in self.regions]
+
+
+_region_router: Optional[RegionRouter] = None
+
+def get_region_router() -> RegionRouter:
+    """The region router (built from the environment on first use)."""
+    global _region_router
+    if _region_router is None:
+        _region_router = RegionRouter(get_azure_regions())
+    return _region_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared Azure resources at startup and close them at shutdown."""
+    global _http_client
+    _http_client = create_http_client()
+    router = get_region_router()
+    if AZURE_TOKEN_AUTH:
+        for state in router.regions:
+            get_token_manager(state.key, state.region).start()
+    router.start()
+    await deck_queue.start()
+    try:
+        yield
+    finally:
+        for job in prewarm_jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+        await deck_queue.stop()
+        await router.stop()
+        for manager in _token_managers.values():
+            await manager.stop()
+        await _http_client.aclose()
+        _http_client = None
+
+# ═══════════════════════════════════════════════════════════
+# REQUEST DEADLINES
+# ═══════════════════════════════════════════════════════════
+
+# Absolute deadline (time.monotonic()) of the request being served, if any
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current request's deadline (None = no deadline)."""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def deadline_exceeded() -> HTTPException:
+    return HTTPException(status_code=504, detail="Deadline exceeded")
+
+
+class DeadlineMiddleware:
+    """
+    Sets the request deadline from X-Request-Deadline-Ms or the endpoint default.
+    
+    Pure ASGI so the deadline lands in the same context as the endpoint.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        budget_ms = ENDPOINT_DEADLINES_MS.get(scope["path"])
+        for name, value in scope["headers"]:
+            if name == b"x-request-deadline-ms":
+                try:
+                    budget_ms = min(DEADLINE_MAX_MS, max(0.0, float(value)))
+                except ValueError:
+                    pass
+        if budget_ms is None:
+            return await self.app(scope, receive, send)
+        token = request_deadline.set(time.monotonic() + budget_ms / 1000)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+
+
 # ═══════════════════════════════════════════════════════════
 # FASTAPI APP
 # ═══════════════════════════════════════════════════════════
@@ -97,6 +679,7 @@ app = FastAPI(
     title="HanziMaster TTS Service",
     description="Azure-based Chinese TTS with phoneme control (REST API)",
     version="2.1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -107,6 +690,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(DeadlineMiddleware)
+
 # ═══════════════════════════════════════════════════════════
 # REQUEST/RESPONSE MODELS
 # ═══════════════════════════════════════════════════════════
@@ -116,17 +701,41 @@ class SynthesizeRequest(BaseModel):
     text: str
     voice: Optional[str] = DEFAULT_VOICE
     pinyin: Optional[str] = None
+    delivery: str = "inline"  # "inline" (audioBase64) or "url" (audioUrl)
+    format: Optional[str] = None  # Key of OUTPUT_FORMATS, default "mp3"
 
 
 class SynthesizeResponse(BaseModel):
     """Response with synthesized audio"""
-    audioBase64: str
+    audioBase64: Optional[str] = None
+    audioUrl: Optional[str] = None
     format: str = "mp3"
     durationMs: Optional[int] = None
     charactersUsed: int
     voice: str
     latencyMs: int
     usedPhoneme: bool = False
+    cached: bool = False
+
+
+class SynthesizeBatchRequest(BaseModel):
+    """Request to synthesize several words at once"""
+    items: List[SynthesizeRequest]
+
+
+class BatchItemResult(BaseModel):
+    """Result for one item of a batch (either result or error is set)"""
+    index: int
+    status: int
+    result: Optional[SynthesizeResponse] = None
+    error: Optional[str] = None
+
+
+class SynthesizeBatchResponse(BaseModel):
+    """Response with per-item results, in request order"""
+    results: List[BatchItemResult]
+    charactersUsed: int
+    latencyMs: int
 
 
 class VoiceInfo(BaseModel):
@@ -167,6 +776,74 @@ class MFCCResponse(BaseModel):
     latencyMs: int
 
 
+class PrefetchRequest(BaseModel):
+    """Upcoming words of a lesson to cache ahead of time"""
+    items: List[SynthesizeRequest]
+    clientId: Optional[str] = None  # A newer prefetch from the same client cancels the older one
+
+
+class PrefetchResponse(BaseModel):
+    """Accepted prefetch"""
+    prefetchId: str
+    accepted: int
+    alreadyCached: int
+
+
+# ═══════════════════════════════════════════════════════════
+# DECK MODELS
+# ═══════════════════════════════════════════════════════════
+
+class DeckRequest(BaseModel):
+    """A deck of words to generate in the background"""
+    name: Optional[str] = None
+    format: Optional[str] = None  # Default for items without their own format
+    items: List[SynthesizeRequest]
+
+
+class DeckStatus(BaseModel):
+    """State of a deck-generation job"""
+    deckId: str
+    name: Optional[str] = None
+    state: str  # pending, running, finished
+    total: int
+    done: int
+    failed: int
+    createdAt: float
+    downloadUrl: Optional[str] = None
+
+
+# ═══════════════════════════════════════════════════════════
+# PREWARM MODELS
+# ═══════════════════════════════════════════════════════════
+
+class PrewarmWord(BaseModel):
+    """One vocabulary entry to prewarm, in one or more voices"""
+    text: str
+    pinyin: Optional[str] = None
+    voices: List[str] = [DEFAULT_VOICE]
+
+
+class PrewarmRequest(BaseModel):
+    """Word list to push through the synthesis path ahead of time"""
+    words: List[PrewarmWord]
+    formats: List[str] = [DEFAULT_FORMAT]
+    concurrency: Optional[int] = None
+
+
+class PrewarmStatus(BaseModel):
+    """Progress of a prewarm job"""
+    jobId: str
+    state: str  # running, finished, interrupted, failed
+    total: int
+    synthesized: int
+    skipped: int
+    failed: int
+    remaining: int
+    etaSeconds: Optional[int] = None
+    elapsedSeconds: int
+    errors: List[str] = []
+
+
 # ═══════════════════════════════════════════════════════════
 # PINYIN TO PHONEME CONVERSION
 # ═══════════════════════════════════════════════════════════
@@ -235,148 +912,2052 @@ def build_ssml(text: str, voice_id: str, pinyin: Optional[str] = None) -> str:
 
 
 # ═══════════════════════════════════════════════════════════
-# ENDPOINTS
+# OUTPUT FORMATS
 # ═══════════════════════════════════════════════════════════
 
-@app.get("/health", response_model=HealthResponse)
-async def health_check():
-    """Health check endpoint"""
-    key, region = get_azure_config()
-    return HealthResponse(
-        status="ok",
-        configured=bool(key),
-        provider="Azure Speech Services (REST)",
-        region=region,
-        voiceCount=len(VOICES),
-    )
+def resolve_format(name: Optional[str]) -> str:
+    """Validate a requested format name, falling back to the default."""
+    name = name or DEFAULT_FORMAT
+    if name not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown format: {name} (supported: {', '.join(OUTPUT_FORMATS)})"
+        )
+    return name
 
 
-@app.get("/voices", response_model=list[VoiceInfo])
-async def get_voices():
-    """Get available voices"""
-    return [
-        VoiceInfo(
-            id=v["id"],
-            key=key,
-            name=v["name"],
-            gender=v["gender"],
-            description=v["description"],
-            language=v["language"],
-        )
-        for key, v in VOICES.items()
-    ]
+def negotiate_format(name: Optional[str], accept: Optional[str]) -> str:
+    """Pick a format from an explicit name, else from the Accept header."""
+    if name:
+        return resolve_format(name)
+    for media_range in (accept or "").lower().split(","):
+        media_type = media_range.split(";")[0].strip()
+        for accepted, format_name in ACCEPT_FORMATS:
+            if media_type == accepted:
+                return format_name
+    return DEFAULT_FORMAT
 
 
-@app.post("/synthesize", response_model=SynthesizeResponse)
-async def synthesize(request: SynthesizeRequest):
+def sniff_audio_extension(data: bytes) -> str:
     """
-    Synthesize speech from Chinese text using Azure REST API.
+    Guess the file extension of audio bytes from their magic number.
     
-    For accurate pronunciation, provide pinyin with tone:
-    - Tone marks: "xiè", "nǐ hǎo"
-    - Tone numbers: "xie4", "ni3 hao3"
+    Only a fallback for clips whose format wasn't recorded: raw PCM can
+    start with bytes that look like an MP3 frame sync.
     """
-    key, region = get_azure_config()
-    if not key:
-        raise HTTPException(status_code=500, detail="Azure Speech key not configured")
-    
-    if not request.text or not request.text.strip():
-        raise HTTPException(status_code=400, detail="Text is required")
-    
-    # Get voice
-    voice_key = request.voice or DEFAULT_VOICE
-    if voice_key not in VOICES:
-        raise HTTPException(status_code=400, detail=f"Unknown voice: {voice_key}")
-    
-    voice_id = VOICES[voice_key]["id"]
-    text = request.text.strip()
-    
-    # Build SSML (pinyin hint is logged but not used for phonemes currently)
-    ssml = build_ssml(text, voice_id, request.pinyin)
-    
-    print(f"[TTS] Text: '{text}', Pinyin: '{request.pinyin}', Voice: {voice_key}")
-    
-    try:
-        start_time = time.time()
-        
-        # Azure TTS REST endpoint
-        endpoint = f"https://{region}.tts.speech.microsoft.com/cognitiveservices/v1"
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                endpoint,
-                headers={
-                    "Ocp-Apim-Subscription-Key": key,
-                    "Content-Type": "application/ssml+xml",
-                    "X-Microsoft-OutputFormat": "audio-16khz-128kbitrate-mono-mp3",
-                    "User-Agent": "HanziMasterTTS",
-                },
-                content=ssml.encode("utf-8"),
-            )
-        
-        end_time = time.time()
-        latency_ms = int((end_time - start_time) * 1000)
-        
-        if response.status_code == 200:
-            audio_data = response.content
-            audio_base64 = base64.b64encode(audio_data).decode("utf-8")
-            
-            print(f"[TTS] Success! Latency: {latency_ms}ms, Audio size: {len(audio_data)} bytes")
-            
-            return SynthesizeResponse(
-                audioBase64=audio_base64,
-                format="mp3",
-                charactersUsed=len(text),
-                voice=voice_key,
-                latencyMs=latency_ms,
-                usedPhoneme=False,  # Phonemes disabled - Azure handles Chinese well
-            )
-        else:
-            error_text = response.text
-            print(f"[TTS] Azure error {response.status_code}: {error_text}")
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Azure TTS error ({response.status_code}): {error_text}"
-            )
-        
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="Request timed out")
-    except Exception as e:
-        print(f"[TTS] Exception: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
+    if data[:4] == b"OggS":
+        return "ogg"
+    if data[:4] == b"RIFF":
+        return "wav"
+    if data[:3] == b"ID3" or (len(data) > 1 and data[0] == 0xFF and data[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return "pcm"
 
 
 # ═══════════════════════════════════════════════════════════
-# MFCC EXTRACTION ENDPOINT
+# MP3 FRAMES
 # ═══════════════════════════════════════════════════════════
 
-@app.post("/extract-mfcc", response_model=MFCCResponse)
-async def extract_mfcc(request: MFCCRequest):
+# Layer III bitrates (kbps) by bitrate index
+MP3_BITRATES_V1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MP3_BITRATES_V2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+
+# Sample rates by version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+@dataclass
+class Mp3Frame:
+    """One MPEG audio Layer III frame, located by its header."""
+    offset: int
+    size: int
+    bitrate: int  # kbps
+    sample_rate: int
+    samples: int
+
+
+def _id3v2_size(data: bytes) -> int:
+    """Length of a leading ID3v2 tag (0 if none)."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size
+
+
+def parse_mp3_frame_header(data: bytes, offset: int) -> Optional[Mp3Frame]:
+    """Parse the 4-byte Layer III frame header at offset (None if not one)."""
+    if offset + 4 > len(data):
+        return None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    padding = (b2 >> 1) & 0x01
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    if version == 3:
+        bitrate = MP3_BITRATES_V1[bitrate_index]
+        samples = 1152
+        size = 144 * bitrate * 1000 // sample_rate + padding
+    else:
+        bitrate = MP3_BITRATES_V2[bitrate_index]
+        samples = 576
+        size = 72 * bitrate * 1000 // sample_rate + padding
+    return Mp3Frame(offset=offset, size=size, bitrate=bitrate, sample_rate=sample_rate, samples=samples)
+
+
+def parse_mp3_frames(data: bytes) -> List[Mp3Frame]:
     """
-    Extract MFCC (Mel-frequency Cepstral Coefficients) from audio.
+    Walk the frame headers of an MP3 without decoding any audio.
     
-    Used for speech comparison in the mobile app to detect if the user
-    said the correct words vs gibberish.
+    Skips a leading ID3v2 tag and resynchronizes byte by byte over junk.
+    A truncated final frame is dropped.
+    """
+    frames = []
+    offset = _id3v2_size(data)
+    while offset + 4 <= len(data):
+        frame = parse_mp3_frame_header(data, offset)
+        if frame is None:
+            offset += 1
+            continue
+        if offset + frame.size > len(data):
+            break
+        frames.append(frame)
+        offset += frame.size
+    return frames
+
+
+# ═══════════════════════════════════════════════════════════
+# AUDIO CACHE
+# ═══════════════════════════════════════════════════════════
+
+def normalize_text(text: Optional[str]) -> str:
+    """Normalize text for cache keys (NFC, trimmed, single spaces)."""
+    if not text:
+        return ""
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+def synthesis_key(text: str, voice_id: str, pinyin: Optional[str], output_format: str) -> str:
+    """Stable key for one synthesized clip: text + voice + pinyin + format."""
+    parts = [normalize_text(text), voice_id, normalize_text(pinyin).lower(), output_format]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _wav_info(data: bytes) -> Optional[Tuple[float, int]]:
+    """(seconds, kbps) from a WAV header, without reading the samples."""
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            rate = wav.getframerate()
+            kbps = rate * wav.getsampwidth() * wav.getnchannels() * 8 // 1000
+            return wav.getnframes() / rate, kbps
+    except (wave.Error, EOFError):
+        return None
+
+
+def _ogg_opus_seconds(data: bytes) -> Optional[float]:
+    """Duration of an Ogg Opus stream from its last page's granule position."""
+    head = data.find(b"OpusHead")
+    last = data.rfind(b"OggS")
+    if head < 0 or last < 0 or last + 14 > len(data) or head + 12 > len(data):
+        return None
+    granule = int.from_bytes(data[last + 6:last + 14], "little")
+    pre_skip = int.from_bytes(data[head + 10:head + 12], "little")
+    return max(0, granule - pre_skip) / 48000  # Opus granules always count 48 kHz samples
+
+
+@dataclass
+class AudioClip:
+    """Synthesized audio plus the metadata we keep alongside it."""
+    key: str
+    data: bytes
+    output_format: Optional[str]  # Azure format name, None if unknown (read back from disk)
+    created_at: float = field(default_factory=time.time)
+    # Filled in once by analyze() when the clip is cached
+    analyzed: bool = field(default=False, repr=False)
+    duration_ms: Optional[int] = None
+    frame_count: Optional[int] = None  # MP3 only
+    bitrate: Optional[int] = None  # kbps, averaged over the clip
+    frame_offsets: Optional[np.ndarray] = field(default=None, repr=False)  # Byte offset of each MP3 frame
+    frame_seconds: float = 0.0  # Playback time of one MP3 frame
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def extension(self) -> str:
+        """File extension of the clip's format (sniffed only if the format is unknown)."""
+        if self.output_format in AZURE_FORMAT_EXTENSIONS:
+            return AZURE_FORMAT_EXTENSIONS[self.output_format]
+        return sniff_audio_extension(self.data)
+
+    def analyze(self) -> None:
+        """
+        Read duration and bitrate from the container/frame headers.
+        
+        Nothing is decoded: MP3 walks the frame headers (also building the
+        seek index), WAV reads its header, raw PCM is sized by its sample
+        rate and Ogg Opus uses the last page's granule position. Runs once.
+        """
+        if self.analyzed:
+            return
+        self.analyzed = True
+        kind = self.extension  # Trusts the known format; sniffs only when it's unknown
+        seconds = None
+        if kind == "mp3":
+            frames = parse_mp3_frames(self.data)
+            self.frame_offsets = np.array([frame.offset for frame in frames], dtype=np.uint32)
+            self.frame_count = len(frames)
+            if frames:
+                self.frame_seconds = frames[0].samples / frames[0].sample_rate
+                seconds = sum(frame.samples / frame.sample_rate for frame in frames)
+                self.bitrate = round(sum(frame.size for frame in frames) * 8 / seconds / 1000)
+        elif kind == "wav":
+            info = _wav_info(self.data)
+            if info is not None:
+                seconds, self.bitrate = info
+        elif kind == "ogg":
+            seconds = _ogg_opus_seconds(self.data)
+            if seconds:
+                self.bitrate = round(self.size * 8 / seconds / 1000)
+        elif kind == "pcm" and self.output_format:
+            sample_rate = _pcm_sample_rate(self.output_format)
+            seconds = self.size / 2 / sample_rate  # 16-bit mono
+            self.bitrate = sample_rate * 16 // 1000
+        if seconds is not None:
+            self.duration_ms = round(seconds * 1000)
+
+    def offset_at(self, seconds: float) -> Optional[int]:
+        """Byte offset of the frame playing at `seconds` (None if past the end or not indexed)."""
+        if self.frame_offsets is None or not len(self.frame_offsets):
+            return None
+        if not seconds < len(self.frame_offsets) * self.frame_seconds:
+            return None  # Past the end (also catches inf and nan)
+        index = min(int(seconds / self.frame_seconds), len(self.frame_offsets) - 1)
+        return int(self.frame_offsets[index])
+
+
+class FrequencySketch:
+    """
+    Count-min sketch of recent key popularity, used for cache admission.
     
-    Input: Base64 encoded MP3 audio
-    Output: MFCC feature matrix for DTW comparison
+    Four rows of saturating 4-bit-range counters (stored as uint8). After
+    10 * width increments every counter is halved, so the sketch tracks
+    recent popularity and old favourites fade out.
     """
-    start_time = time.time()
+
+    DEPTH = 4
+    MAX_COUNT = 15
+
+    def __init__(self, width: int):
+        self.width = 1 << max(4, (width - 1).bit_length())  # Power of two for masking
+        self.sample_size = 10 * self.width
+        self.additions = 0
+        self.resets = 0
+        self._table = np.zeros((self.DEPTH, self.width), dtype=np.uint8)
+        self._rows = np.arange(self.DEPTH)
+
+    def _indexes(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * self.DEPTH).digest()
+        return np.frombuffer(digest, dtype="<u4") & (self.width - 1)
+
+    def frequency(self, key: str) -> int:
+        return int(self._table[self._rows, self._indexes(key)].min())
+
+    def increment(self, key: str) -> None:
+        indexes = self._indexes(key)
+        counts = self._table[self._rows, indexes]
+        if counts.min() >= self.MAX_COUNT:
+            return
+        # Conservative update: only raise the counters holding the minimum
+        low = counts == counts.min()
+        self._table[self._rows[low], indexes[low]] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._table >>= 1
+            self.additions //= 2
+            self.resets += 1
+
+    def stats(self) -> dict:
+        return {
+            "width": self.width,
+            "bytes": self._table.nbytes,
+            "resets": self.resets,
+        }
+
+
+class AudioCache:
+    """
+    In-process cache for synthesized audio, bounded by total bytes.
     
-    if not request.audioBase64:
-        raise HTTPException(status_code=400, detail="audioBase64 is required")
+    Uses W-TinyLFU: new clips land in a small LRU window; when the window
+    overflows, its oldest clip only enters the main cache if the frequency
+    sketch says it is more popular than the clip it would evict. One-off
+    sentences therefore age out of the window without flushing hot
+    vocabulary. The main cache is a segmented LRU (probation/protected),
+    so clips hit twice are shielded from newcomers.
     
-    try:
-        # Decode base64 to bytes
-        audio_bytes = base64.b64decode(request.audioBase64)
-        print(f"[MFCC] Received {len(audio_bytes)} bytes of audio")
-        
-        # Load audio using librosa (handles MP3, WAV, etc.)
-        lib = get_librosa()
-        
-        # Load audio from bytes
-        audio_buffer = io.BytesIO(audio_bytes)
-        
+    Not thread-safe; only touched from the event loop.
+    """
+
+    def __init__(self, max_bytes: int, window_ratio: float = 0.01, protected_ratio: float = 0.8):
+        self.max_bytes = max_bytes
+        self.window_max = int(max_bytes * window_ratio)
+        self.main_max = max_bytes - self.window_max
+        self.protected_max = int(self.main_max * protected_ratio)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        # Roughly one counter per small clip the cache could hold
+        self.sketch = FrequencySketch(max(1024, max_bytes // 8192))
+        self._window: "OrderedDict[str, AudioClip]" = OrderedDict()
+        self._probation: "OrderedDict[str, AudioClip]" = OrderedDict()
+        self._protected: "OrderedDict[str, AudioClip]" = OrderedDict()
+        self._bytes = {"window": 0, "probation": 0, "protected": 0}
+        self._segments = {"window": self._window, "probation": self._probation, "protected": self._protected}
+        self._where: Dict[str, str] = {}
+
+    @property
+    def current_bytes(self) -> int:
+        return sum(self._bytes.values())
+
+    def _add(self, segment: str, clip: AudioClip) -> None:
+        self._segments[segment][clip.key] = clip
+        self._bytes[segment] += clip.size
+        self._where[clip.key] = segment
+
+    def _remove(self, key: str) -> Optional[AudioClip]:
+        segment = self._where.pop(key, None)
+        if segment is None:
+            return None
+        clip = self._segments[segment].pop(key)
+        self._bytes[segment] -= clip.size
+        return clip
+
+    def get(self, key: str) -> Optional[AudioClip]:
+        self.sketch.increment(key)
+        segment = self._where.get(key)
+        if segment is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if segment == "probation":
+            # Second hit: promote, demoting the protected segment's oldest if it overflows
+            clip = self._remove(key)
+            self._add("protected", clip)
+            while self._bytes["protected"] > self.protected_max and len(self._protected) > 1:
+                _, demoted = self._protected.popitem(last=False)
+                self._bytes["protected"] -= demoted.size
+                self._add("probation", demoted)
+            return clip
+        entries = self._segments[segment]
+        entries.move_to_end(key)
+        return entries[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._where
+
+    def put(self, clip: AudioClip) -> None:
+        if clip.size > self.max_bytes:
+            return
+        clip.analyze()
+        segment = self._where.get(clip.key)
+        if segment is not None:
+            # Same key means same audio; just refresh the entry in place
+            self._remove(clip.key)
+            self._add(segment, clip)
+            return
+        self._add("window", clip)
+        while self._bytes["window"] > self.window_max:
+            _, candidate = self._window.popitem(last=False)
+            self._bytes["window"] -= candidate.size
+            del self._where[candidate.key]
+            self._admit(candidate)
+
+    def _admit(self, candidate: AudioClip) -> None:
+        """Move a clip from the window into the main cache if it beats the victims."""
+        if candidate.size > self.main_max:
+            self.rejections += 1
+            return
+        candidate_freq = self.sketch.frequency(candidate.key)
+        while self._bytes["probation"] + self._bytes["protected"] + candidate.size > self.main_max:
+            victims = self._probation or self._protected
+            victim_key = next(iter(victims))
+            if candidate_freq <= self.sketch.frequency(victim_key):
+                self.rejections += 1
+                return
+            self._remove(victim_key)
+            self.evictions += 1
+        self._add("probation", candidate)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._where),
+            "bytes": self.current_bytes,
+            "maxBytes": self.max_bytes,
+            "windowEntries": len(self._window),
+            "protectedEntries": len(self._protected),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "sketch": self.sketch.stats(),
+        }
+
+
+audio_cache = AudioCache(AUDIO_CACHE_MAX_BYTES, window_ratio=AUDIO_CACHE_WINDOW_RATIO)
+
+
+# Stored files start with this, a length byte and the Azure output format
+AUDIO_FILE_MAGIC = b"HMA1"
+
+
+class DiskAudioStore:
+    """
+    Content-addressed audio store on disk.
+    
+    Files live at <root>/<key[:2]>/<key[2:4]>/<key> so no directory grows
+    beyond a few thousand entries. Writes go to a temp file in the same
+    directory and are renamed into place, so concurrent workers only ever
+    see complete files and duplicate writes of the same key are harmless.
+    
+    Each file carries a short header naming the clip's Azure output format,
+    so the format never has to be guessed from the audio bytes. Files
+    written before the header existed are read back with an unknown format.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _read(self, key: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        try:
+            with open(self.path_for(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(AUDIO_FILE_MAGIC):
+            return data, None
+        start = len(AUDIO_FILE_MAGIC) + 1
+        end = start + data[len(AUDIO_FILE_MAGIC)]
+        return data[end:], data[start:end].decode("ascii") or None
+
+    def _write(self, key: str, data: bytes, output_format: Optional[str]) -> None:
+        name = (output_format or "").encode("ascii")
+        header = AUDIO_FILE_MAGIC + bytes([len(name)]) + name
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path_for(key))
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Audio bytes and Azure output format (None for old files) of a key."""
+        try:
+            data = await asyncio.to_thread(self._read, key)
+        except OSError as e:
+            print(f"[STORE] Read failed for {key}: {e}")
+            self.errors += 1
+            return None
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes, output_format: Optional[str] = None) -> None:
+        try:
+            await asyncio.to_thread(self._write, key, data, output_format)
+            self.writes += 1
+        except OSError as e:
+            print(f"[STORE] Write failed for {key}: {e}")
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+
+
+audio_store: Optional[DiskAudioStore] = DiskAudioStore(AUDIO_STORE_DIR) if AUDIO_STORE_DIR else None
+
+
+async def lookup_audio(key: str, output_format: Optional[str] = None) -> Optional[AudioClip]:
+    """Look a clip up in memory, then on disk (promoting disk hits to memory)."""
+    clip = audio_cache.get(key)
+    if clip is not None:
+        return clip
+    if audio_store is None:
+        return None
+    found = await audio_store.get(key)
+    if found is None:
+        return None
+    data, stored_format = found
+    clip = AudioClip(key=key, data=data, output_format=stored_format or output_format)
+    audio_cache.put(clip)
+    return clip
+
+
+async def store_audio(clip: AudioClip) -> None:
+    """Save a freshly synthesized clip to memory and disk."""
+    audio_cache.put(clip)
+    if audio_store is not None:
+        await audio_store.put(clip.key, clip.data, clip.output_format)
+
+
+# ═══════════════════════════════════════════════════════════
+# SINGLE-FLIGHT
+# ═══════════════════════════════════════════════════════════
+
+class _FlightCall:
+    """A shared in-flight call and who is waiting on it."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.pinned = False
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one shared task.
+    
+    The first caller starts the work; everyone else awaits the same task and
+    gets the same result or exception. Callers wait through asyncio.shield,
+    so a cancelled caller never cancels the call while others still need it.
+    When the last waiter goes away (e.g. the client disconnected) the call
+    is cancelled too, unless a pinned caller (a cache fill such as prefetch,
+    prewarm or a deck job) joined it, in which case it always completes.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        self._calls: Dict[str, _FlightCall] = {}
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        call = self._calls.get(key)
+        if call is not None and call.task is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        pinned: bool = False,
+    ) -> Tuple[Any, bool]:
+        """Run fn() once per key. Returns (result, leader)."""
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            task = asyncio.ensure_future(fn())
+            call = _FlightCall(task)
+            self._calls[key] = call
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        call.pinned = call.pinned or pinned
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), leader
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.pinned and not call.task.done():
+                # Nobody else wants the result: stop the upstream work
+                call.task.cancel()
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                self.abandoned += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    def stats(self) -> dict:
+        return {
+            "inFlight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
+
+
+synthesis_flight = SingleFlight()
+
+
+# ═══════════════════════════════════════════════════════════
+# RESILIENCE
+# ═══════════════════════════════════════════════════════════
+
+class AzureError(HTTPException):
+    """
+    A failed Azure call, marked with whether it is worth retrying.
+    
+    overload is set when Azure itself signalled it was overloaded (429,
+    503, 504 or a timeout), independent of the status we report to clients.
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        detail: str,
+        retryable: bool = False,
+        retry_after: Optional[float] = None,
+        region: Optional[str] = None,
+        overload: bool = False,
+    ):
+        headers = None
+        if retry_after is not None:
+            headers = {"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.region = region
+        self.overload = overload
+
+
+class DeadlineExceeded(AzureError):
+    """The caller's request deadline ran out; says nothing about Azure's health."""
+
+    def __init__(self, region: Optional[str] = None):
+        super().__init__(status_code=504, detail="Deadline exceeded", region=region)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff in seconds."""
+    cap = min(AZURE_RETRY_MAX_MS, AZURE_RETRY_BASE_MS * (2 ** attempt))
+    return random.uniform(0, cap) / 1000
+
+
+class LatencyTracker:
+    """Rolling window of recent Azure latencies for percentile estimates."""
+
+    def __init__(self, size: int = 500):
+        self._samples: deque = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ResilienceStats:
+    """Counters for retries and hedges."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def as_dict(self) -> dict:
+        p50 = azure_latency.percentile(0.5)
+        p95 = azure_latency.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "p50Ms": int(p50 * 1000) if p50 is not None else None,
+            "p95Ms": int(p95 * 1000) if p95 is not None else None,
+        }
+
+
+class CircuitBreaker:
+    """
+    Stops calling Azure after repeated failures.
+    
+    closed:    calls go through; consecutive failures are counted.
+    open:      calls fail fast with 503 so only cached audio is served.
+    half-open: after CIRCUIT_OPEN_SECONDS one probe call is let through;
+               success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        """Raise if the call should not go to Azure right now."""
+        if self.state == "closed":
+            return
+        remaining = self.opened_at + self.open_seconds - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half-open"
+        if self.state == "half-open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        self.rejected += 1
+        raise AzureError(
+            status_code=503,
+            detail="Synthesis temporarily unavailable (serving cached audio only)",
+            retry_after=max(1.0, remaining),
+        )
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            print("[CIRCUIT] Closed")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half-open" or (
+            self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            print(f"[CIRCUIT] Open after {self.consecutive_failures} failures")
+        self._probe_in_flight = False
+
+    def release(self) -> None:
+        """Forget a half-open probe that ended without a verdict (e.g. a 400)."""
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.consecutive_failures,
+            "timesOpened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent Azure calls with a bounded wait queue.
+    
+    Each success raises the limit by about one per limit's worth of calls;
+    an overload signal (429, 503, timeout) cuts it by AZURE_LIMIT_BACKOFF,
+    at most once per second so one burst of 429s doesn't collapse it.
+    Callers over the limit wait in a FIFO queue; when the queue is full or
+    the wait exceeds AZURE_QUEUE_TIMEOUT they get a fast 503.
+    """
+
+    def __init__(
+        self,
+        initial: float,
+        min_limit: float,
+        max_limit: float,
+        max_queue: int,
+        queue_timeout: float,
+    ):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.shed = 0
+        self._last_decrease = 0.0
+        self._waiters: deque = deque()
+
+    def _shed(self, reason: str) -> AzureError:
+        self.shed += 1
+        return AzureError(status_code=503, detail=f"Synthesis overloaded: {reason}", retry_after=1.0)
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._shed("queue full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        timeout = self.queue_timeout
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = max(0.0, min(timeout, budget))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just as we gave up: hand it on
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._shed("queue timeout")
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_overload(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease >= 1.0:
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit * AZURE_LIMIT_BACKOFF)
+            print(f"[LIMIT] Overload, limit now {self.limit:.1f}")
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inFlight": self.in_flight,
+            "queued": len(self._waiters),
+            "shed": self.shed,
+        }
+
+
+azure_latency = LatencyTracker()
+resilience_stats = ResilienceStats()
+azure_circuit = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+azure_limiter = AdaptiveLimiter(
+    AZURE_LIMIT_INITIAL, AZURE_LIMIT_MIN, AZURE_LIMIT_MAX, AZURE_QUEUE_MAX, AZURE_QUEUE_TIMEOUT
+)
+
+
+# ═══════════════════════════════════════════════════════════
+# AZURE SYNTHESIS
+# ═══════════════════════════════════════════════════════════
+
+class _LimiterSlotStream(httpx.AsyncByteStream):
+    """A streamed response body that gives its limiter slot back when closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, limiter: AdaptiveLimiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._limiter.release()
+
+
+async def send_to_azure(
+    ssml: str,
+    output_format: str,
+    stream: bool = False,
+    exclude: Tuple[str, ...] = (),
+) -> Tuple[httpx.Response, RegionState]:
+    """
+    POST SSML to the best Azure region's TTS REST endpoint.
+    
+    Returns the 200 response and the region that served it; with
+    stream=True the body is left unread and the caller must close it.
+    Regions in `exclude` are avoided if any other is available. Any
+    failure is raised as an AzureError carrying the region it came from.
+    
+    Holds a slot of the adaptive limiter for the duration of the call;
+    for streams the slot is held until the caller closes the response.
+    
+    The call's timeout is capped by the request deadline, and a call that
+    couldn't plausibly finish in the remaining budget isn't started.
+    """
+    check_budget()
+    await azure_limiter.acquire()
+    try:
+        response, state = await _send_to_region(ssml, output_format, stream, exclude)
+    except BaseException as e:
+        if isinstance(e, AzureError) and e.overload:
+            azure_limiter.on_overload()
+        azure_limiter.release()
+        raise
+    if stream:
+        # Azure is still producing the body: it counts against the limit
+        response.stream = _LimiterSlotStream(response.stream, azure_limiter)
+    else:
+        azure_limiter.release()
+    azure_limiter.on_success()
+    return response, state
+
+
+async def _send_to_region(
+    ssml: str,
+    output_format: str,
+    stream: bool,
+    exclude: Tuple[str, ...],
+) -> Tuple[httpx.Response, RegionState]:
+    router = get_region_router()
+    state = router.choose(exclude)
+    if state is None:
+        raise HTTPException(status_code=500, detail="Azure Speech key not configured")
+    
+    token_manager = get_token_manager(state.key, state.region)
+    
+    timeout = HTTP_TIMEOUT
+    budget = remaining_budget()
+    if budget is not None:
+        if budget <= 0:
+            raise DeadlineExceeded()
+        timeout = min(timeout, budget)
+    
+    start_time = time.monotonic()
+    try:
+        client = get_http_client()
+        azure_request = client.build_request(
+            "POST",
+            state.endpoint,
+            timeout=timeout,
+            headers={
+                **(await token_manager.auth_headers()),
+                "Content-Type": "application/ssml+xml",
+                "X-Microsoft-OutputFormat": output_format,
+            },
+            content=ssml.encode("utf-8"),
+        )
+        response = await client.send(azure_request, stream=stream)
+        if response.status_code != 200 and stream:
+            await response.aread()
+            await response.aclose()
+    except httpx.TimeoutException:
+        if budget is not None and timeout >= budget:
+            # Ran out of request budget, not necessarily the region's fault
+            raise DeadlineExceeded(region=state.region)
+        router.record_failure(state)
+        raise AzureError(
+            status_code=504, detail="Request timed out", retryable=True, region=state.region, overload=True
+        )
+    except httpx.HTTPError as e:
+        print(f"[TTS] Exception ({state.region}): {str(e)}")
+        router.record_failure(state)
+        raise AzureError(
+            status_code=500, detail=f"Synthesis failed: {str(e)}", retryable=True, region=state.region
+        )
+    
+    if response.status_code != 200:
+        status = response.status_code
+        error_text = response.text
+        print(f"[TTS] Azure error {status} ({state.region}): {error_text}")
+        detail = f"Azure TTS error ({status}): {error_text}"
+        if status == 429:
+            router.record_failure(state)
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            raise AzureError(
+                status_code=503,
+                detail=detail,
+                retryable=True,
+                retry_after=retry_after,
+                region=state.region,
+                overload=True,
+            )
+        if status == 401:
+            # Stale token: the retry falls back to the subscription key
+            token_manager.invalidate()
+        if status in (401, 403) or status >= 500:
+            # A region that rejects our key is as unusable as one that is down
+            router.record_failure(state)
+        # 403 won't change on the same region, but another region may accept us
+        rejected_here = status == 403 and len(router.regions) > 1
+        raise AzureError(
+            status_code=500,
+            detail=detail,
+            retryable=status == 401 or rejected_here or status >= 500,
+            region=state.region,
+            overload=status in (503, 504),
+        )
+    
+    elapsed = time.monotonic() - start_time
+    if stream:
+        # Time to headers isn't comparable with full-body latency
+        router.record_success(state)
+    else:
+        router.record_success(state, elapsed)
+        azure_latency.record(elapsed)
+    return response, state
+
+
+def check_budget() -> None:
+    """Fail fast when the request deadline leaves no realistic time for Azure."""
+    budget = remaining_budget()
+    if budget is None:
+        return
+    fastest = azure_latency.percentile(0.05) or 0.0
+    if budget <= fastest:
+        raise DeadlineExceeded()
+
+
+async def send_with_retries(ssml: str, output_format: str, stream: bool = False) -> httpx.Response:
+    """
+    send_to_azure() with jittered exponential retries for transient failures.
+    
+    Each retry prefers a region that hasn't failed yet, so with several
+    regions configured a retry is also a failover. A 429's Retry-After is
+    used as the delay when retrying the same region; if Azure asks us to
+    wait longer than AZURE_RETRY_AFTER_MAX we give up instead of holding
+    the request open.
+    
+    The whole exchange sits behind the circuit breaker: while it is open
+    this fails immediately with 503 instead of waiting on Azure.
+    """
+    azure_circuit.before_call()
+    try:
+        response = await _retry_loop(ssml, output_format, stream)
+    except AzureError as e:
+        if e.retryable:
+            azure_circuit.record_failure()
+        else:
+            azure_circuit.release()
+        raise
+    except BaseException:
+        azure_circuit.release()
+        raise
+    azure_circuit.record_success()
+    return response
+
+
+async def _retry_loop(ssml: str, output_format: str, stream: bool) -> httpx.Response:
+    attempt = 0
+    failed: Tuple[str, ...] = ()
+    while True:
+        try:
+            response, _ = await send_to_azure(ssml, output_format, stream=stream, exclude=failed)
+            return response
+        except AzureError as e:
+            if not e.retryable or attempt >= AZURE_RETRIES:
+                raise
+            if e.region and e.region not in failed:
+                failed += (e.region,)
+            failover = get_region_router().choose(failed).region not in failed
+            delay = backoff_delay(0) if failover else backoff_delay(attempt)
+            if e.retry_after is not None and not failover:
+                delay = e.retry_after
+            if delay > AZURE_RETRY_AFTER_MAX:
+                raise
+            budget = remaining_budget()
+            typical = azure_latency.percentile(0.5) or 0.0
+            if budget is not None and delay + typical >= budget:
+                # A retry couldn't finish before the deadline
+                raise
+        attempt += 1
+        resilience_stats.retries += 1
+        await asyncio.sleep(delay)
+
+
+def hedge_delay() -> Optional[float]:
+    """Seconds to wait before hedging, or None if hedging is off or over budget."""
+    if not AZURE_HEDGE:
+        return None
+    if resilience_stats.hedges >= AZURE_HEDGE_MAX_RATIO * max(1, resilience_stats.requests):
+        return None
+    p95 = azure_latency.percentile(0.95)
+    if p95 is None:
+        return None
+    delay = max(p95, AZURE_HEDGE_MIN_DELAY_MS / 1000)
+    budget = remaining_budget()
+    if budget is not None and delay + azure_latency.percentile(0.5) >= budget:
+        # A hedge fired that late couldn't beat the deadline
+        return None
+    return delay
+
+
+async def fetch_from_azure(ssml: str, output_format: str) -> bytes:
+    """
+    Synthesize SSML on Azure and return the complete audio bytes.
+    
+    With hedging on, a request still running after the recent p95 latency
+    gets a second identical request; whichever succeeds first wins and the
+    other is cancelled.
+    """
+    resilience_stats.requests += 1
+    
+    async def _attempt() -> bytes:
+        response = await send_with_retries(ssml, output_format)
+        return response.content
+    
+    delay = hedge_delay()
+    if delay is None:
+        return await _attempt()
+    
+    primary = asyncio.ensure_future(_attempt())
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+        
+        resilience_stats.hedges += 1
+        hedge = asyncio.ensure_future(_attempt())
+        pending.add(hedge)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        resilience_stats.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def get_or_synthesize(
+    text: str,
+    voice_id: str,
+    pinyin: Optional[str],
+    output_format: str,
+    batchable: bool = False,
+    pinned: bool = False,
+) -> Tuple[AudioClip, bool]:
+    """
+    Return the clip for this text/voice/pinyin/format, synthesizing on a miss.
+    
+    Returns (clip, fresh) where fresh is True only for the caller whose
+    request actually went to Azure (and so spent characters). Bulk callers
+    pass batchable=True to let the miss share a multi-word Azure request.
+    Cache fills pass pinned=True so the synthesis finishes even if every
+    interactive caller waiting on it disconnects.
+    """
+    key = synthesis_key(text, voice_id, pinyin, output_format)
+    clip = await lookup_audio(key, output_format)
+    if clip is not None:
+        return clip, False
+    
+    async def _synthesize() -> AudioClip:
+        # Build SSML (pinyin hint is logged but not used for phonemes currently)
+        ssml = build_ssml(text, voice_id, pinyin)
+        print(f"[TTS] Text: '{text}', Pinyin: '{pinyin}', Voice: {voice_id}")
+        if batchable and MICROBATCH_ENABLED:
+            data = await micro_batcher.synthesize(text, voice_id, output_format, ssml)
+        else:
+            data = await fetch_from_azure(ssml, output_format)
+        fresh_clip = AudioClip(key=key, data=data, output_format=output_format)
+        # The audio is paid for: keep it even if the caller goes away now
+        await asyncio.shield(store_audio(fresh_clip))
+        return fresh_clip
+    
+    try:
+        return await synthesis_flight.do(key, _synthesize, pinned=pinned)
+    except DeadlineExceeded:
+        if not pinned or request_deadline.get() is not None:
+            raise
+        # Joined a call bound by an interactive caller's deadline; the fill has
+        # none of its own, so go again rather than fail on someone else's clock
+        return await synthesis_flight.do(key, _synthesize, pinned=True)
+
+
+# ═══════════════════════════════════════════════════════════
+# MICRO-BATCHING
+# ═══════════════════════════════════════════════════════════
+
+def build_ssml_batch(texts: List[str], voice_id: str, break_ms: int) -> str:
+    """Build one SSML document speaking every text, separated by silence."""
+    separator = f'\n        <break time="{break_ms}ms"/>\n        '
+    content = separator.join(xml_escape(text) for text in texts)
+    return f'''<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="zh-CN">
+    <voice name="{voice_id}">
+        {content}
+    </voice>
+</speak>'''
+
+
+def _pcm_sample_rate(output_format: str) -> int:
+    match = re.search(r"(\d+)khz", output_format)
+    return int(match.group(1)) * 1000 if match else 16000
+
+
+def _decode_for_split(data: bytes, output_format: str) -> Tuple[np.ndarray, int]:
+    """Decode batch audio to mono float samples for silence detection."""
+    if output_format.startswith("raw-"):
+        samples = np.frombuffer(data[: len(data) // 2 * 2], dtype="<i2").astype(np.float32) / 32768
+        return samples, _pcm_sample_rate(output_format)
+    samples, sample_rate = get_soundfile().read(io.BytesIO(data), dtype="float32")
+    if len(samples.shape) > 1:
+        samples = samples.mean(axis=1)
+    return samples, sample_rate
+
+
+def find_word_gaps(
+    samples: np.ndarray,
+    sample_rate: int,
+    words: int,
+    min_gap_seconds: float,
+) -> Optional[List[float]]:
+    """
+    Find the silences between words; returns the centre time of each gap.
+    
+    Only interior silences at least min_gap_seconds long count. Returns
+    None unless there are exactly words - 1 of them, i.e. the split is
+    unambiguous.
+    """
+    window = max(1, sample_rate // 100)  # 10ms
+    count = len(samples) // window
+    if count == 0:
+        return None
+    rms = np.sqrt(np.mean(samples[: count * window].reshape(count, window) ** 2, axis=1))
+    silent = rms < 10 ** (-50 / 20)
+    voiced = np.flatnonzero(~silent)
+    if len(voiced) == 0:
+        return None
+    
+    gaps = []
+    run_start = None
+    for i in range(voiced[0], voiced[-1] + 1):
+        if silent[i] and run_start is None:
+            run_start = i
+        elif not silent[i] and run_start is not None:
+            if (i - run_start) * window / sample_rate >= min_gap_seconds:
+                gaps.append((run_start + i) / 2 * window / sample_rate)
+            run_start = None
+    
+    if len(gaps) != words - 1:
+        return None
+    return gaps
+
+
+def _wav_bytes(frames: bytes, channels: int, sample_width: int, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(sample_width)
+        out.setframerate(sample_rate)
+        out.writeframes(frames)
+    return buffer.getvalue()
+
+
+def can_split_format(output_format: str) -> bool:
+    """Whether split_batch_audio() can cut this Azure format (MP3, WAV, raw PCM)."""
+    return "mp3" in output_format or output_format.startswith(("riff-", "raw-"))
+
+
+def split_batch_audio(data: bytes, output_format: str, words: int, break_ms: int) -> Optional[List[bytes]]:
+    """
+    Split multi-word audio back into one clip per word.
+    
+    MP3 is cut on frame boundaries (no re-encoding), WAV and raw PCM on
+    sample boundaries, each in the middle of the silence between words.
+    Returns None when the format can't be split or the silences don't
+    line up with the word count, so the caller can fall back.
+    """
+    if not can_split_format(output_format):
+        return None
+    try:
+        samples, sample_rate = _decode_for_split(data, output_format)
+    except Exception as e:
+        print(f"[BATCH] Could not decode batch audio: {e}")
+        return None
+    
+    gaps = find_word_gaps(samples, sample_rate, words, min_gap_seconds=break_ms * 0.6 / 1000)
+    if gaps is None:
+        return None
+    
+    if "mp3" in output_format:
+        frames = parse_mp3_frames(data)
+        if not frames:
+            return None
+        starts = []
+        elapsed = 0.0
+        for frame in frames:
+            starts.append(elapsed)
+            elapsed += frame.samples / frame.sample_rate
+        cuts = [0]
+        for gap in gaps:
+            nearest = min(range(len(frames)), key=lambda i: abs(starts[i] - gap))
+            cuts.append(nearest)
+        cuts.append(len(frames))
+        if any(b <= a for a, b in zip(cuts, cuts[1:])):
+            return None
+        ends = [frames[i].offset for i in cuts[1:-1]] + [frames[-1].offset + frames[-1].size]
+        return [data[frames[a].offset:end] for a, end in zip(cuts, ends)]
+    
+    if output_format.startswith("raw-"):
+        cuts = [0] + [int(gap * sample_rate) * 2 for gap in gaps] + [len(data) // 2 * 2]
+        return [data[a:b] for a, b in zip(cuts, cuts[1:])]
+    
+    try:
+        with wave.open(io.BytesIO(data), "rb") as source:
+            channels, sample_width, rate = source.getnchannels(), source.getsampwidth(), source.getframerate()
+            pcm = source.readframes(source.getnframes())
+    except (wave.Error, EOFError) as e:
+        print(f"[BATCH] Could not read batch WAV: {e}")
+        return None
+    frame_bytes = channels * sample_width
+    cuts = [0] + [int(gap * rate) * frame_bytes for gap in gaps] + [len(pcm)]
+    return [_wav_bytes(pcm[a:b], channels, sample_width, rate) for a, b in zip(cuts, cuts[1:])]
+
+
+class MicroBatcher:
+    """
+    Collects cache misses for a short window and synthesizes them together.
+    
+    Misses for the same voice and format that arrive within
+    MICROBATCH_WINDOW_MS are sent as one SSML document with breaks between
+    words, and the audio is split back into per-word clips. If the request
+    fails or the split is ambiguous, each word is synthesized on its own.
+    """
+
+    def __init__(self, window_ms: float, max_words: int, max_chars: int, break_ms: int):
+        self.window = window_ms / 1000
+        self.max_words = max_words
+        self.max_chars = max_chars
+        self.break_ms = break_ms
+        self.batches = 0
+        self.batched_words = 0
+        self.fallbacks = 0
+        self._pending: Dict[Tuple[str, str], List[Tuple[str, str, asyncio.Future]]] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+
+    async def synthesize(self, text: str, voice_id: str, output_format: str, ssml: str) -> bytes:
+        """Queue one word; resolves to its own audio bytes."""
+        if not can_split_format(output_format):
+            # Ogg/Opus can't be cut apart, so batching would only waste a request
+            return await fetch_from_azure(ssml, output_format)
+        group = (voice_id, output_format)
+        pending = self._pending.setdefault(group, [])
+        if pending and sum(len(t) for t, _, _ in pending) + len(text) > self.max_chars:
+            self._flush(group)
+            pending = self._pending.setdefault(group, [])
+        future = asyncio.get_running_loop().create_future()
+        pending.append((text, ssml, future))
+        if len(pending) >= self.max_words:
+            self._flush(group)
+        elif group not in self._timers:
+            self._timers[group] = asyncio.get_running_loop().call_later(self.window, self._flush, group)
+        return await future
+
+    def _flush(self, group: Tuple[str, str]) -> None:
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(group, [])
+        if items:
+            asyncio.ensure_future(self._run(group, items))
+
+    async def _run(self, group: Tuple[str, str], items: List[Tuple[str, str, asyncio.Future]]) -> None:
+        request_deadline.set(None)  # Shared by several requests; each enforces its own deadline
+        try:
+            await self._synthesize_group(group, items)
+        except Exception as e:
+            # Nobody awaits this task; the waiters are failed below instead
+            print(f"[BATCH] Batch of {len(items)} crashed: {e!r}")
+        finally:
+            # Never leave a waiter hanging: pinned SingleFlight callers would
+            # keep the key in flight forever
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(HTTPException(status_code=500, detail="Batch synthesis failed"))
+
+    async def _synthesize_group(self, group: Tuple[str, str], items: List[Tuple[str, str, asyncio.Future]]) -> None:
+        voice_id, output_format = group
+        clips = None
+        if len(items) > 1:
+            ssml = build_ssml_batch([text for text, _, _ in items], voice_id, self.break_ms)
+            try:
+                data = await fetch_from_azure(ssml, output_format)
+                clips = await asyncio.to_thread(split_batch_audio, data, output_format, len(items), self.break_ms)
+            except HTTPException as e:
+                print(f"[BATCH] Batch of {len(items)} failed ({e.detail}), falling back")
+            except Exception as e:
+                print(f"[BATCH] Could not split batch of {len(items)} ({e!r}), falling back")
+            if clips is None:
+                self.fallbacks += 1
+            else:
+                self.batches += 1
+                self.batched_words += len(items)
+                print(f"[BATCH] Synthesized {len(items)} words in one request")
+        
+        if clips is not None:
+            for (_, _, future), clip in zip(items, clips):
+                if not future.done():
+                    future.set_result(clip)
+            return
+        
+        async def _single(ssml: str, future: asyncio.Future) -> None:
+            try:
+                data = await fetch_from_azure(ssml, output_format)
+            except BaseException as e:
+                if not future.done():
+                    future.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+                return
+            if not future.done():
+                future.set_result(data)
+        
+        await asyncio.gather(*(_single(ssml, future) for _, ssml, future in items))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "batchedWords": self.batched_words,
+            "fallbacks": self.fallbacks,
+        }
+
+
+micro_batcher = MicroBatcher(
+    MICROBATCH_WINDOW_MS, MICROBATCH_MAX_WORDS, MICROBATCH_MAX_CHARS, MICROBATCH_BREAK_MS
+)
+
+
+# ═══════════════════════════════════════════════════════════
+# JSON RESPONSES
+# ═══════════════════════════════════════════════════════════
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """
+    Serialize with orjson, bypassing FastAPI's encoder and response-model validation.
+    
+    numpy arrays are written directly (they must be C-contiguous).
+    """
+    return Response(
+        content=orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
+def json_bytes_response(body: bytes) -> Response:
+    """Send an already-serialized JSON body."""
+    return Response(content=body, media_type="application/json")
+
+
+# Raw bytes per base64 chunk; a multiple of 3 so chunks encode without padding
+BASE64_CHUNK_BYTES = 48 * 1024
+
+
+def audio_json_parts(response: SynthesizeResponse, data: Optional[bytes]) -> List[Any]:
+    """
+    A SynthesizeResponse as JSON pieces for streamed_json_response().
+    
+    bytes are written as-is; a memoryview is audio still to be base64-encoded.
+    """
+    fields = orjson.dumps(response.model_dump(exclude={"audioBase64"}))
+    if data is None:
+        return [b'{"audioBase64":null,' + fields[1:]]
+    return [b'{"audioBase64":"', memoryview(data), b'",' + fields[1:]]
+
+
+def streamed_json_response(parts: List[Any]) -> StreamingResponse:
+    """
+    Stream JSON pieces, base64-encoding audio chunk by chunk on the way out.
+    
+    The audio is never held as one base64 string or inside one JSON
+    document, so the extra memory per request is a single chunk no matter
+    how long the clips are.
+    """
+    size = sum(len(part) if isinstance(part, bytes) else 4 * ((len(part) + 2) // 3) for part in parts)
+    
+    async def body():
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            for offset in range(0, len(part), BASE64_CHUNK_BYTES):
+                yield base64.b64encode(part[offset:offset + BASE64_CHUNK_BYTES])
+    
+    return StreamingResponse(body(), media_type="application/json", headers={"Content-Length": str(size)})
+
+
+def inline_audio_response(response: SynthesizeResponse, data: bytes) -> StreamingResponse:
+    """Stream a SynthesizeResponse with audioBase64 encoded chunk by chunk."""
+    return streamed_json_response(audio_json_parts(response, data))
+
+
+# ═══════════════════════════════════════════════════════════
+# BINARY RESPONSES
+# ═══════════════════════════════════════════════════════════
+
+# Accept media types that select a binary encoding instead of JSON
+BINARY_MEDIA_TYPES = {
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/cbor": "cbor",
+}
+
+
+def negotiate_encoding(accept: Optional[str]) -> Optional[str]:
+    """Binary encoding requested by the Accept header, or None for JSON."""
+    for media_range in (accept or "").lower().split(","):
+        media_type = media_range.split(";")[0].strip()
+        if media_type in BINARY_MEDIA_TYPES:
+            return BINARY_MEDIA_TYPES[media_type]
+        if media_type in ("application/json", "*/*"):
+            return None
+    return None
+
+
+def binary_response(content: Any, encoding: str) -> Response:
+    """Encode content as MessagePack or CBOR; bytes values stay raw binary."""
+    if encoding == "cbor":
+        return Response(content=get_cbor2().dumps(content), media_type="application/cbor")
+    return Response(content=get_msgpack().packb(content, use_bin_type=True), media_type="application/msgpack")
+
+
+def with_raw_audio(fields: dict, clip: Optional[AudioClip]) -> dict:
+    """Swap a dumped SynthesizeResponse's audioBase64 for the raw audio bytes."""
+    fields.pop("audioBase64", None)
+    fields["audio"] = clip.data if clip is not None else None
+    return fields
+
+
+# /voices never changes, so validate and serialize it once
+VOICES_BODY = orjson.dumps([
+    VoiceInfo(
+        id=v["id"],
+        key=key,
+        name=v["name"],
+        gender=v["gender"],
+        description=v["description"],
+        language=v["language"],
+    ).model_dump()
+    for key, v in VOICES.items()
+])
+
+# /health has only a handful of distinct bodies; serialize each one once
+_health_bodies: Dict[Tuple[str, bool, str], bytes] = {}
+
+
+# ═══════════════════════════════════════════════════════════
+# ENDPOINTS
+# ═══════════════════════════════════════════════════════════
+
+@app.get("/health", response_model=HealthResponse)
+async def health_check():
+    """Health check endpoint"""
+    _, region = get_azure_config()
+    best = get_region_router().choose()
+    variant = (
+        "ok" if azure_circuit.state == "closed" else "degraded",
+        best is not None,
+        best.region if best else region,
+    )
+    body = _health_bodies.get(variant)
+    if body is None:
+        status, configured, region = variant
+        body = orjson.dumps(HealthResponse(
+            status=status,
+            configured=configured,
+            provider="Azure Speech Services (REST)",
+            region=region,
+            voiceCount=len(VOICES),
+        ).model_dump())
+        _health_bodies[variant] = body
+    return json_bytes_response(body)
+
+
+@app.get("/voices", response_model=list[VoiceInfo])
+async def get_voices():
+    """Get available voices"""
+    return json_bytes_response(VOICES_BODY)
+
+
+@app.get("/stats")
+async def get_stats():
+    """Cache and synthesis counters"""
+    return json_response({
+        "audioCache": audio_cache.stats(),
+        "audioStore": audio_store.stats() if audio_store else None,
+        "singleFlight": synthesis_flight.stats(),
+        "auth": [manager.stats() for manager in _token_managers.values()],
+        "azure": resilience_stats.as_dict(),
+        "regions": get_region_router().stats(),
+        "circuit": azure_circuit.stats(),
+        "limiter": azure_limiter.stats(),
+        "microBatch": micro_batcher.stats(),
+        "prefetch": prefetcher.stats(),
+        "disconnects": disconnect_stats,
+    })
+
+
+async def synthesize_one(
+    request: SynthesizeRequest,
+    batchable: bool = False,
+    pinned: bool = False,
+) -> SynthesizeResponse:
+    """Validate one synthesis request and build its response (cache-aware)."""
+    response, clip = await synthesize_clip(request, batchable, pinned)
+    if request.delivery == "inline":
+        response.audioBase64 = base64.b64encode(clip.data).decode("utf-8")
+    return response
+
+
+async def synthesize_clip(
+    request: SynthesizeRequest,
+    batchable: bool = False,
+    pinned: bool = False,
+) -> Tuple[SynthesizeResponse, AudioClip]:
+    """Like synthesize_one(), but leaves inline audio unencoded and returns the clip."""
+    if not request.text or not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text is required")
+    
+    # Get voice
+    voice_key = request.voice or DEFAULT_VOICE
+    if voice_key not in VOICES:
+        raise HTTPException(status_code=400, detail=f"Unknown voice: {voice_key}")
+    
+    if request.delivery not in ("inline", "url"):
+        raise HTTPException(status_code=400, detail=f"Unknown delivery: {request.delivery}")
+    
+    format_name = resolve_format(request.format)
+    spec = OUTPUT_FORMATS[format_name]
+    voice_id = VOICES[voice_key]["id"]
+    text = request.text.strip()
+    start_time = time.time()
+    
+    clip, fresh = await get_or_synthesize(text, voice_id, request.pinyin, spec["azure"], batchable, pinned)
+    
+    latency_ms = int((time.time() - start_time) * 1000)
+    if fresh:
+        print(f"[TTS] Success! Latency: {latency_ms}ms, Audio size: {clip.size} bytes")
+    clip.analyze()
+    
+    response = SynthesizeResponse(
+        audioUrl=audio_url(clip.key, spec["ext"]) if request.delivery == "url" else None,
+        format=format_name,
+        durationMs=clip.duration_ms,
+        charactersUsed=len(text) if fresh else 0,
+        voice=voice_key,
+        latencyMs=latency_ms,
+        usedPhoneme=False,  # Phonemes disabled - Azure handles Chinese well
+        cached=not fresh,
+    )
+    return response, clip
+
+
+async def run_until_disconnected(http_request: Request, work: Awaitable[Any]) -> Any:
+    """
+    Await work, cancelling it if the client disconnects or the deadline passes.
+    
+    Cancelling only drops this caller; SingleFlight keeps the Azure call
+    going while anyone else still needs its result.
+    """
+    task = asyncio.ensure_future(work)
+    
+    async def _wait_for_disconnect() -> None:
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+    
+    watcher = asyncio.ensure_future(_wait_for_disconnect())
+    budget = remaining_budget()
+    try:
+        await asyncio.wait(
+            {task, watcher},
+            timeout=max(0.0, budget) if budget is not None else None,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        if not watcher.done() or watcher.cancelled():
+            disconnect_stats["deadlineExceeded"] += 1
+            raise deadline_exceeded()
+        disconnect_stats["cancelled"] += 1
+        # Nobody will read this response
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    return task.result()
+
+
+disconnect_stats = {"cancelled": 0, "deadlineExceeded": 0}
+
+
+@app.post("/synthesize", response_model=SynthesizeResponse)
+async def synthesize(
+    request: SynthesizeRequest,
+    http_request: Request,
+    accept: Optional[str] = Header(None),
+):
+    """
+    Synthesize speech from Chinese text using Azure REST API.
+    
+    For accurate pronunciation, provide pinyin with tone:
+    - Tone marks: "xiè", "nǐ hǎo"
+    - Tone numbers: "xie4", "ni3 hao3"
+    
+    Inline audio is base64-encoded while it is sent rather than up front.
+    With Accept: application/msgpack or application/cbor the response is
+    encoded that way instead, with the audio as a raw binary "audio" field.
+    """
+    encoding = negotiate_encoding(accept)
+    response, clip = await run_until_disconnected(http_request, synthesize_clip(request))
+    if encoding is not None:
+        inline_clip = clip if request.delivery == "inline" else None
+        return binary_response(with_raw_audio(response.model_dump(), inline_clip), encoding)
+    if request.delivery == "url":
+        return response
+    return inline_audio_response(response, clip.data)
+
+
+@app.post("/synthesize/stream")
+async def synthesize_stream(request: SynthesizeRequest, http_request: Request):
+    """
+    Synthesize speech and stream raw audio to the client as Azure produces it.
+    
+    Playback can start on the first chunk instead of waiting for the whole
+    clip. The streamed audio is collected on the side and cached once the
+    upstream response completes; a cache hit is returned in one piece.
+    The format comes from the request body, else the Accept header.
+    """
+    if not request.text or not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text is required")
+    
+    voice_key = request.voice or DEFAULT_VOICE
+    if voice_key not in VOICES:
+        raise HTTPException(status_code=400, detail=f"Unknown voice: {voice_key}")
+    
+    spec = OUTPUT_FORMATS[negotiate_format(request.format, http_request.headers.get("accept"))]
+    media_type = spec["mediaType"]
+    voice_id = VOICES[voice_key]["id"]
+    text = request.text.strip()
+    output_format = spec["azure"]
+    key = synthesis_key(text, voice_id, request.pinyin, output_format)
+    headers = {"X-Audio-Key": key, "Vary": "Accept"}
+    
+    clip = await lookup_audio(key, output_format)
+    if clip is None and key in synthesis_flight:
+        # Someone is already synthesizing this clip; wait for it rather than paying twice
+        clip, _ = await get_or_synthesize(text, voice_id, request.pinyin, output_format)
+    if clip is not None:
+        headers["X-Cache"] = "hit"
+        clip.analyze()
+        if clip.duration_ms is not None:
+            headers["X-Audio-Duration-Ms"] = str(clip.duration_ms)
+        return Response(content=clip.data, media_type=media_type, headers=headers)
+    
+    ssml = build_ssml(text, voice_id, request.pinyin)
+    print(f"[TTS] Stream: '{text}', Pinyin: '{request.pinyin}', Voice: {voice_key}")
+    upstream = await send_with_retries(ssml, output_format, stream=True)
+    
+    async def _relay():
+        chunks = []
+        complete = False
+        try:
+            async for chunk in upstream.aiter_bytes():
+                chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            await upstream.aclose()
+            # Only cache audio we received in full
+            if complete:
+                await store_audio(AudioClip(key=key, data=b"".join(chunks), output_format=output_format))
+    
+    headers["X-Cache"] = "miss"
+    return StreamingResponse(_relay(), media_type=media_type, headers=headers)
+
+
+@app.post("/synthesize/batch", response_model=SynthesizeBatchResponse)
+async def synthesize_batch(
+    request: SynthesizeBatchRequest,
+    http_request: Request,
+    accept: Optional[str] = Header(None),
+):
+    """
+    Synthesize a list of words in one round trip (e.g. a whole lesson).
+    
+    Duplicate items are synthesized once. Cache misses go to Azure with at
+    most BATCH_CONCURRENCY calls in flight. Each item gets its own result or
+    error, so one bad word doesn't fail the batch. Honors the same binary
+    Accept types as /synthesize.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    
+    encoding = negotiate_encoding(accept)
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def _run(item: SynthesizeRequest) -> Tuple[BatchItemResult, Optional[AudioClip]]:
+        async with semaphore:
+            try:
+                response, clip = await synthesize_clip(item, batchable=True)
+            except HTTPException as e:
+                return BatchItemResult(index=0, status=e.status_code, error=str(e.detail)), None
+            inline_clip = clip if item.delivery == "inline" else None
+            return BatchItemResult(index=0, status=200, result=response), inline_clip
+    
+    # Dedupe on everything that affects the response
+    unique: Dict[tuple, asyncio.Task] = {}
+    item_keys = []
+    for item in request.items:
+        dedupe_key = (
+            normalize_text(item.text),
+            item.voice or DEFAULT_VOICE,
+            normalize_text(item.pinyin).lower(),
+            item.delivery,
+            item.format or DEFAULT_FORMAT,
+        )
+        item_keys.append(dedupe_key)
+        if dedupe_key not in unique:
+            unique[dedupe_key] = asyncio.ensure_future(_run(item))
+    
+    await run_until_disconnected(http_request, asyncio.gather(*unique.values()))
+    
+    results = []
+    clips = []
+    seen = set()
+    for index, dedupe_key in enumerate(item_keys):
+        outcome, clip = unique[dedupe_key].result()
+        update = {"index": index}
+        if dedupe_key in seen and outcome.result is not None:
+            # Characters are only spent once per unique item
+            update["result"] = outcome.result.model_copy(update={"charactersUsed": 0, "cached": True})
+        seen.add(dedupe_key)
+        results.append(outcome.model_copy(update=update))
+        clips.append(clip)
+    
+    latency_ms = int((time.time() - start_time) * 1000)
+    print(f"[TTS] Batch: {len(results)} items, {len(unique)} unique, {latency_ms}ms")
+    
+    response = SynthesizeBatchResponse(
+        results=results,
+        charactersUsed=sum(r.result.charactersUsed for r in results if r.result),
+        latencyMs=latency_ms,
+    )
+    if encoding is not None:
+        content = response.model_dump()
+        for item, clip in zip(content["results"], clips):
+            if item["result"] is not None:
+                with_raw_audio(item["result"], clip)
+        return binary_response(content, encoding)
+    
+    # Stream the envelope so inline audio is base64-encoded chunk by chunk
+    parts: List[Any] = [b'{"results":[']
+    for i, (result, clip) in enumerate(zip(response.results, clips)):
+        if i:
+            parts.append(b",")
+        head = orjson.dumps(result.model_dump(exclude={"result"}))[:-1] + b',"result":'
+        if result.result is None:
+            parts.append(head + b"null}")
+            continue
+        parts.append(head)
+        parts.extend(audio_json_parts(result.result, clip.data if clip is not None else None))
+        parts.append(b"}")
+    totals = orjson.dumps({"charactersUsed": response.charactersUsed, "latencyMs": response.latencyMs})
+    parts.append(b"]," + totals[1:])
+    return streamed_json_response(parts)
+
+
+# ═══════════════════════════════════════════════════════════
+# AUDIO FILES
+# ═══════════════════════════════════════════════════════════
+
+AUDIO_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Clips are content-addressed, so a URL's bytes never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def audio_url(key: str, ext: str) -> str:
+    """Public URL of a cached clip."""
+    return f"{AUDIO_BASE_URL}/audio/{key}.{ext}"
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range into inclusive (start, end).
+    
+    Returns None when there is no usable single range (serve the whole
+    clip); raises 416 when the range lies beyond the clip.
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not dash or not (first or last) or not (first + last).isdigit():
+        return None
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(last))
+        end = size - 1
+    if start >= size or end < start:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against our strong ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+@app.get("/audio/{key}.{ext}")
+async def get_audio(key: str, ext: str, request: Request, t: Optional[float] = None):
+    """
+    Serve a synthesized clip as raw audio.
+    
+    URLs come from /synthesize with delivery="url". The key already fixes
+    the format, so the content never changes and responses are immutable.
+    
+    Supports single byte Range requests (206). For MP3, ?t=<seconds> seeks
+    by time: the response starts at the frame playing at t, looked up in
+    the frame index built when the clip was cached.
+    """
+    if not AUDIO_KEY_PATTERN.match(key) or ext not in EXTENSION_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    clip = await lookup_audio(key)
+    if clip is None or clip.extension != ext:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    
+    media_type = EXTENSION_MEDIA_TYPES[ext]
+    size = clip.size
+    if t is not None:
+        if ext != "mp3":
+            raise HTTPException(status_code=400, detail="Time seeking is only supported for MP3")
+        if not math.isfinite(t):
+            raise HTTPException(status_code=400, detail="t must be a finite number of seconds")
+        clip.analyze()  # Already done unless the cache turned the clip away
+        start = clip.offset_at(max(0.0, t))
+        if start is None:
+            raise HTTPException(
+                status_code=416,
+                detail="Seek past the end of the clip",
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        byte_range = (start, size - 1)
+    else:
+        # Content never changes, so any If-Range other than our ETag is just stale
+        if_range = request.headers.get("if-range")
+        byte_range = None if if_range and if_range.strip() != etag else parse_range(request.headers.get("range"), size)
+    
+    if byte_range is None:
+        return Response(content=clip.data, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=clip.data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+
+# ═══════════════════════════════════════════════════════════
+# MFCC EXTRACTION ENDPOINT
+# ═══════════════════════════════════════════════════════════
+
+@app.post("/extract-mfcc", response_model=MFCCResponse)
+async def extract_mfcc(request: MFCCRequest, accept: Optional[str] = Header(None)):
+    """
+    Extract MFCC (Mel-frequency Cepstral Coefficients) from audio.
+    
+    Used for speech comparison in the mobile app to detect if the user
+    said the correct words vs gibberish.
+    
+    Input: Base64 encoded MP3 audio
+    Output: MFCC feature matrix for DTW comparison
+    
+    With Accept: application/msgpack or application/cbor, coefficients are
+    sent as raw little-endian float32 bytes (row-major, numFrames x numCoeffs).
+    """
+    start_time = time.time()
+    
+    if not request.audioBase64:
+        raise HTTPException(status_code=400, detail="audioBase64 is required")
+    
+    try:
+        # Decode base64 to bytes
+        audio_bytes = base64.b64decode(request.audioBase64)
+        print(f"[MFCC] Received {len(audio_bytes)} bytes of audio")
+        
+        # Load audio using librosa (handles MP3, WAV, etc.)
+        lib = get_librosa()
+        
+        # Load audio from bytes
+        audio_buffer = io.BytesIO(audio_bytes)
+        
         # Use soundfile to read, librosa to process
         sf = get_soundfile()
         samples, original_sr = sf.read(audio_buffer)
@@ -406,9 +2987,9 @@ async def extract_mfcc(request: MFCCRequest):
             n_fft=n_fft,
         )
         
-        # Transpose to [numFrames, numCoeffs] and convert to list
-        mfcc_transposed = mfcc.T.tolist()
-        num_frames = len(mfcc_transposed)
+        # Transpose to [numFrames, numCoeffs]; orjson writes the array directly
+        mfcc_transposed = np.ascontiguousarray(mfcc.T, dtype=np.float32)
+        num_frames = mfcc_transposed.shape[0]
         duration_ms = (len(samples) / target_sr) * 1000
         
         end_time = time.time()
@@ -416,26 +2997,803 @@ async def extract_mfcc(request: MFCCRequest):
         
         print(f"[MFCC] Extracted {num_frames} frames in {latency_ms}ms")
         
-        return MFCCResponse(
-            coefficients=mfcc_transposed,
-            sampleRate=target_sr,
-            hopMs=10,  # 160 samples at 16kHz = 10ms
-            numCoeffs=n_mfcc,
-            durationMs=duration_ms,
-            numFrames=num_frames,
-            latencyMs=latency_ms,
-        )
+        # Shaped like MFCCResponse, but skips validating every float
+        encoding = negotiate_encoding(accept)
+        content = {
+            "coefficients": mfcc_transposed,
+            "sampleRate": target_sr,
+            "hopMs": 10,  # 160 samples at 16kHz = 10ms
+            "numCoeffs": n_mfcc,
+            "durationMs": duration_ms,
+            "numFrames": num_frames,
+            "latencyMs": latency_ms,
+        }
+        if encoding is not None:
+            content["coefficients"] = mfcc_transposed.astype("<f4").tobytes()
+            return binary_response(content, encoding)
+        return json_response(content)
         
     except Exception as e:
         print(f"[MFCC] Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"MFCC extraction failed: {str(e)}")
 
 
+# ═══════════════════════════════════════════════════════════
+# SPECULATIVE PREFETCH
+# ═══════════════════════════════════════════════════════════
+
+class TokenBucket:
+    """Simple async token bucket (rate per second, burst = rate)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self._updated = time.monotonic()
+
+    async def take(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Prefetcher:
+    """
+    Fills the cache with words the app will ask for soon, at low priority.
+    
+    Prefetch only calls Azure while interactive traffic leaves headroom
+    under the adaptive limit, at most PREFETCH_CONCURRENCY at a time and
+    PREFETCH_RATE per second. Each prefetch can be cancelled, and a new
+    one from the same client replaces the old (the learner moved on).
+    """
+
+    def __init__(self, concurrency: int, rate: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate)
+        self.synthesized = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._by_client: Dict[str, str] = {}
+
+    async def _wait_for_headroom(self) -> bool:
+        deadline = time.monotonic() + PREFETCH_MAX_WAIT
+        while azure_circuit.state != "closed" or azure_limiter.stats()["queued"] or (
+            azure_limiter.in_flight >= azure_limiter.limit * PREFETCH_HEADROOM
+        ):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def _run(self, items: List[SynthesizeRequest]) -> None:
+        request_deadline.set(None)  # Background work, not bound by the /prefetch request
+        # Fan out so PREFETCH_CONCURRENCY words are in flight together and
+        # the micro-batcher can pack them into shared Azure requests
+        await asyncio.gather(*(self._one(item) for item in items))
+
+    async def _one(self, item: SynthesizeRequest) -> None:
+        async with self.semaphore:
+            if not await self._wait_for_headroom():
+                self.dropped += 1
+                return
+            await self.bucket.take()
+            try:
+                await synthesize_one(item, batchable=True, pinned=True)
+                self.synthesized += 1
+            except HTTPException:
+                self.dropped += 1
+
+    def start(self, items: List[SynthesizeRequest], client_id: Optional[str]) -> str:
+        if client_id and client_id in self._by_client:
+            self.cancel(self._by_client[client_id])
+        prefetch_id = secrets.token_hex(8)
+        task = asyncio.ensure_future(self._run(items))
+        self._tasks[prefetch_id] = task
+        if client_id:
+            self._by_client[client_id] = prefetch_id
+        
+        def _done(_: asyncio.Task) -> None:
+            self._tasks.pop(prefetch_id, None)
+            if client_id and self._by_client.get(client_id) == prefetch_id:
+                del self._by_client[client_id]
+        
+        task.add_done_callback(_done)
+        return prefetch_id
+
+    def cancel(self, prefetch_id: str) -> bool:
+        task = self._tasks.get(prefetch_id)
+        if task is None:
+            return False
+        task.cancel()
+        self.cancelled += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._tasks),
+            "synthesized": self.synthesized,
+            "dropped": self.dropped,
+            "cancelled": self.cancelled,
+        }
+
+
+prefetcher = Prefetcher(PREFETCH_CONCURRENCY, PREFETCH_RATE)
+
+
+@app.post("/prefetch", response_model=PrefetchResponse, status_code=202)
+async def prefetch(request: PrefetchRequest):
+    """
+    Speculatively cache the next words of a lesson.
+    
+    Returns immediately; later /synthesize calls for these words hit the
+    cache. Items already cached are not queued.
+    """
+    if len(request.items) > PREFETCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {PREFETCH_MAX_ITEMS} items per prefetch")
+    
+    pending = []
+    cached = 0
+    for item in request.items:
+        if not item.text or not item.text.strip() or (item.voice or DEFAULT_VOICE) not in VOICES:
+            continue
+        spec = OUTPUT_FORMATS[resolve_format(item.format)]
+        voice_id = VOICES[item.voice or DEFAULT_VOICE]["id"]
+        if synthesis_key(item.text, voice_id, item.pinyin, spec["azure"]) in audio_cache:
+            cached += 1
+        else:
+            pending.append(item.model_copy(update={"delivery": "url"}))
+    
+    prefetch_id = prefetcher.start(pending, request.clientId)
+    return PrefetchResponse(prefetchId=prefetch_id, accepted=len(pending), alreadyCached=cached)
+
+
+@app.delete("/prefetch/{prefetch_id}", status_code=204)
+async def cancel_prefetch(prefetch_id: str):
+    """Cancel a prefetch that is no longer needed."""
+    if not prefetcher.cancel(prefetch_id):
+        raise HTTPException(status_code=404, detail="Prefetch not found")
+    return Response(status_code=204)
+
+
+# ═══════════════════════════════════════════════════════════
+# DECK JOBS
+# ═══════════════════════════════════════════════════════════
+
+DECK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    created_at REAL NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deck_items (
+    deck_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    voice TEXT NOT NULL,
+    pinyin TEXT,
+    format TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    audio_key TEXT,
+    error TEXT,
+    PRIMARY KEY (deck_id, idx)
+);
+CREATE INDEX IF NOT EXISTS deck_items_state ON deck_items (state, not_before);
+"""
+
+
+class DeckQueue:
+    """
+    Deck-generation jobs in SQLite, so they survive restarts.
+    
+    Every uvicorn worker runs DECK_WORKERS loops that claim one pending item
+    at a time inside an IMMEDIATE transaction, so items are never processed
+    twice concurrently. Failed items are retried with backoff up to
+    DECK_MAX_ATTEMPTS; items claimed by a worker that died are picked up
+    again after DECK_CLAIM_TIMEOUT. Generated audio lives in the normal
+    audio cache/store and items only keep its key.
+    """
+
+    def __init__(self, db_path: str, workers: int):
+        self.db_path = db_path
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(DECK_SCHEMA)
+            self._ready = True
+        return conn
+
+    def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Awaitable[Any]:
+        def _with_connection():
+            conn = self._connect()
+            try:
+                return fn(conn)
+            finally:
+                conn.close()
+        return asyncio.to_thread(_with_connection)
+
+    async def submit(self, name: Optional[str], items: List[SynthesizeRequest]) -> str:
+        deck_id = secrets.token_hex(8)
+        
+        def _insert(conn: sqlite3.Connection) -> None:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO decks (id, name, created_at, total) VALUES (?, ?, ?, ?)",
+                (deck_id, name, time.time(), len(items)),
+            )
+            conn.executemany(
+                "INSERT INTO deck_items (deck_id, idx, text, voice, pinyin, format) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (deck_id, i, item.text.strip(), item.voice or DEFAULT_VOICE, item.pinyin, item.format)
+                    for i, item in enumerate(items)
+                ],
+            )
+            conn.execute("COMMIT")
+        
+        await self._run(_insert)
+        return deck_id
+
+    async def status(self, deck_id: str) -> Optional[DeckStatus]:
+        def _query(conn: sqlite3.Connection):
+            deck = conn.execute("SELECT * FROM decks WHERE id = ?", (deck_id,)).fetchone()
+            if deck is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT state, COUNT(*) FROM deck_items WHERE deck_id = ? GROUP BY state", (deck_id,)
+            ).fetchall())
+            return deck, counts
+        
+        result = await self._run(_query)
+        if result is None:
+            return None
+        deck, counts = result
+        done, failed = counts.get("done", 0), counts.get("failed", 0)
+        if done + failed == deck["total"]:
+            state = "finished"
+        elif done or failed or counts.get("running"):
+            state = "running"
+        else:
+            state = "pending"
+        return DeckStatus(
+            deckId=deck_id,
+            name=deck["name"],
+            state=state,
+            total=deck["total"],
+            done=done,
+            failed=failed,
+            createdAt=deck["created_at"],
+            downloadUrl=f"/decks/{deck_id}/download" if state == "finished" else None,
+        )
+
+    async def items(self, deck_id: str) -> List[sqlite3.Row]:
+        return await self._run(lambda conn: conn.execute(
+            "SELECT * FROM deck_items WHERE deck_id = ? ORDER BY idx", (deck_id,)
+        ).fetchall())
+
+    async def _claim(self) -> Optional[sqlite3.Row]:
+        def _claim_one(conn: sqlite3.Connection):
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """SELECT * FROM deck_items
+                   WHERE (state = 'pending' AND not_before <= ?)
+                      OR (state = 'running' AND claimed_at < ?)
+                   ORDER BY not_before LIMIT 1""",
+                (now, now - DECK_CLAIM_TIMEOUT),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    """UPDATE deck_items SET state = 'running', claimed_at = ?, attempts = attempts + 1
+                       WHERE deck_id = ? AND idx = ?""",
+                    (now, row["deck_id"], row["idx"]),
+                )
+            conn.execute("COMMIT")
+            return row
+        
+        return await self._run(_claim_one)
+
+    async def _finish(self, row: sqlite3.Row, audio_key: Optional[str], error: Optional[str]) -> None:
+        attempts = row["attempts"] + 1
+        if audio_key is not None:
+            sql, params = "UPDATE deck_items SET state = 'done', audio_key = ?, error = NULL", (audio_key,)
+        elif attempts < DECK_MAX_ATTEMPTS:
+            sql = "UPDATE deck_items SET state = 'pending', not_before = ?, error = ?"
+            params = (time.time() + 2 ** attempts, error)
+        else:
+            sql, params = "UPDATE deck_items SET state = 'failed', error = ?", (error,)
+        await self._run(lambda conn: conn.execute(
+            f"{sql} WHERE deck_id = ? AND idx = ?", (*params, row["deck_id"], row["idx"])
+        ))
+
+    async def _process(self, row: sqlite3.Row) -> None:
+        try:
+            if row["voice"] not in VOICES:
+                raise HTTPException(status_code=400, detail=f"Unknown voice: {row['voice']}")
+            spec = OUTPUT_FORMATS[resolve_format(row["format"])]
+            clip, _ = await get_or_synthesize(
+                row["text"], VOICES[row["voice"]]["id"], row["pinyin"], spec["azure"],
+                batchable=True, pinned=True,
+            )
+        except HTTPException as e:
+            # Overload and a deadline borrowed from an interactive caller are
+            # transient; bad input won't get better on retry
+            retryable = isinstance(e, DeadlineExceeded) or (
+                isinstance(e, AzureError) and (e.retryable or e.status_code == 503)
+            )
+            error = str(e.detail)
+            if not retryable:
+                await self._run(lambda conn: conn.execute(
+                    "UPDATE deck_items SET state = 'failed', error = ? WHERE deck_id = ? AND idx = ?",
+                    (error, row["deck_id"], row["idx"]),
+                ))
+                return
+            await self._finish(row, None, error)
+            return
+        await self._finish(row, clip.key, None)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                row = await self._claim()
+            except sqlite3.Error as e:
+                print(f"[DECK] Claim failed: {e}")
+                row = None
+            if row is None:
+                await asyncio.sleep(1.0)
+                continue
+            try:
+                await self._process(row)
+            except Exception as e:
+                # One bad item must not take the worker down with it
+                print(f"[DECK] Unexpected error on {row['deck_id']}/{row['idx']}: {e!r}")
+                try:
+                    await self._finish(row, None, f"Internal error: {e}")
+                except Exception as e:
+                    # The stale claim is picked up again after DECK_CLAIM_TIMEOUT
+                    print(f"[DECK] Could not record failure for {row['deck_id']}/{row['idx']}: {e!r}")
+
+    async def start(self) -> None:
+        if self.workers <= 0 or self._tasks:
+            return
+        try:
+            await self._run(lambda conn: None)
+        except (sqlite3.Error, OSError) as e:
+            print(f"[DECK] Deck queue disabled, cannot open {self.db_path}: {e}")
+            return
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+
+deck_queue = DeckQueue(DECK_DB_PATH, DECK_WORKERS)
+
+
+class _ArchiveSink:
+    """Write-only file object that buffers archive output until drained."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _deck_filename(row: sqlite3.Row) -> str:
+    safe_text = re.sub(r"[\\/:*?\"<>|\s]+", "_", row["text"])[:40]
+    ext = OUTPUT_FORMATS[row["format"] or DEFAULT_FORMAT]["ext"]
+    return f"{row['idx']:04d}-{safe_text}-{row['voice']}.{ext}"
+
+
+@app.post("/decks", response_model=DeckStatus, status_code=202)
+async def submit_deck(request: DeckRequest):
+    """
+    Queue a deck for background generation.
+    
+    Poll GET /decks/{deckId}; once finished, download the audio and a
+    manifest from /decks/{deckId}/download.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(request.items) > DECK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {DECK_MAX_ITEMS} items per deck")
+    
+    items = []
+    for item in request.items:
+        if not item.text or not item.text.strip():
+            raise HTTPException(status_code=400, detail="Text is required")
+        if (item.voice or DEFAULT_VOICE) not in VOICES:
+            raise HTTPException(status_code=400, detail=f"Unknown voice: {item.voice}")
+        items.append(item.model_copy(update={"format": resolve_format(item.format or request.format)}))
+    
+    deck_id = await deck_queue.submit(request.name, items)
+    return await deck_queue.status(deck_id)
+
+
+@app.get("/decks/{deck_id}", response_model=DeckStatus)
+async def get_deck(deck_id: str):
+    """Progress of a deck-generation job"""
+    status = await deck_queue.status(deck_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    return status
+
+
+@app.get("/decks/{deck_id}/download")
+async def download_deck(deck_id: str, archive: str = "zip"):
+    """
+    Stream a finished deck as a zip (default) or tar archive.
+    
+    The archive holds manifest.json and one audio file per item. Clips
+    are added one at a time, so memory use doesn't grow with deck size.
+    """
+    if archive not in ("zip", "tar"):
+        raise HTTPException(status_code=400, detail="archive must be zip or tar")
+    status = await deck_queue.status(deck_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    if status.state != "finished":
+        raise HTTPException(status_code=409, detail=f"Deck is {status.state}")
+    
+    rows = await deck_queue.items(deck_id)
+    manifest = {
+        "deckId": deck_id,
+        "name": status.name,
+        "items": [
+            {
+                "index": row["idx"],
+                "text": row["text"],
+                "pinyin": row["pinyin"],
+                "voice": row["voice"],
+                "format": row["format"],
+                "file": _deck_filename(row) if row["state"] == "done" else None,
+                "error": row["error"] if row["state"] != "done" else None,
+            }
+            for row in rows
+        ],
+    }
+    
+    async def _stream():
+        sink = _ArchiveSink()
+        if archive == "zip":
+            writer = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+            add = lambda name, data: writer.writestr(name, data)
+        else:
+            writer = tarfile.open(fileobj=sink, mode="w|")
+            def add(name: str, data: bytes) -> None:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                writer.addfile(info, io.BytesIO(data))
+        
+        add("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+        yield sink.drain()
+        for row in rows:
+            if row["state"] != "done":
+                continue
+            spec = OUTPUT_FORMATS[row["format"]]
+            clip = await lookup_audio(row["audio_key"], spec["azure"])
+            if clip is None:
+                # Evicted and no disk store: synthesize again
+                clip, _ = await get_or_synthesize(
+                    row["text"], VOICES[row["voice"]]["id"], row["pinyin"], spec["azure"], pinned=True
+                )
+            add(_deck_filename(row), clip.data)
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+    
+    filename = f"deck-{deck_id}.{archive}"
+    return StreamingResponse(
+        _stream(),
+        media_type="application/zip" if archive == "zip" else "application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# ═══════════════════════════════════════════════════════════
+# CACHE PREWARMING
+# ═══════════════════════════════════════════════════════════
+
+def parse_word_list(content: str, content_type: str = "application/json") -> PrewarmRequest:
+    """
+    Parse a prewarm word list from JSON or CSV.
+    
+    JSON is a PrewarmRequest body (or a bare list of words). CSV has a
+    header row with a text column and optional pinyin and voices columns;
+    several voices are separated by "|".
+    """
+    if "csv" in content_type:
+        words = []
+        for row in csv.DictReader(io.StringIO(content)):
+            text = (row.get("text") or "").strip()
+            if not text:
+                continue
+            voices = [v.strip() for v in (row.get("voices") or "").split("|") if v.strip()]
+            words.append(PrewarmWord(
+                text=text,
+                pinyin=(row.get("pinyin") or "").strip() or None,
+                voices=voices or [DEFAULT_VOICE],
+            ))
+        return PrewarmRequest(words=words)
+    data = json.loads(content)
+    if isinstance(data, list):
+        data = {"words": data}
+    return PrewarmRequest.model_validate(data)
+
+
+def expand_word_list(word_list: PrewarmRequest) -> List[SynthesizeRequest]:
+    """One synthesis request per word x voice x format."""
+    return [
+        SynthesizeRequest(text=word.text, voice=voice, pinyin=word.pinyin, format=format_name)
+        for word in word_list.words
+        for voice in word.voices
+        for format_name in word_list.formats
+    ]
+
+
+def prewarm_job_id(items: List[SynthesizeRequest]) -> str:
+    """Jobs are named by their content, so resubmitting a list resumes it."""
+    digest = hashlib.sha256()
+    for item in items:
+        digest.update(f"{item.text}\x1f{item.voice}\x1f{item.pinyin}\x1f{item.format}\x1e".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class PrewarmJob:
+    """
+    Runs a word list through the synthesis path in the background.
+    
+    Keys already in the memory cache or disk store are skipped, so a job
+    that was interrupted resumes where it left off when run again. Progress
+    is written next to the audio store so any worker can report it.
+    """
+
+    def __init__(self, job_id: str, items: List[SynthesizeRequest], concurrency: int):
+        self.job_id = job_id
+        self.items = items
+        self.concurrency = max(1, concurrency)
+        self.state = "running"
+        self.synthesized = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._last_saved = 0.0
+
+    @property
+    def processed(self) -> int:
+        return self.synthesized + self.skipped + self.failed
+
+    def status(self) -> PrewarmStatus:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at
+        remaining = len(self.items) - self.processed
+        eta = None
+        if self.state == "running" and self.processed:
+            eta = int(elapsed / self.processed * remaining)
+        return PrewarmStatus(
+            jobId=self.job_id,
+            state=self.state,
+            total=len(self.items),
+            synthesized=self.synthesized,
+            skipped=self.skipped,
+            failed=self.failed,
+            remaining=remaining,
+            etaSeconds=eta,
+            elapsedSeconds=int(elapsed),
+            errors=self.errors[-20:],
+        )
+
+    @staticmethod
+    def status_path(job_id: str) -> Optional[str]:
+        if not AUDIO_STORE_DIR:
+            return None
+        return os.path.join(AUDIO_STORE_DIR, "prewarm", f"{job_id}.json")
+
+    def _save(self, force: bool = False) -> None:
+        path = self.status_path(self.job_id)
+        if path is None or (not force and time.monotonic() - self._last_saved < 2.0):
+            return
+        self._last_saved = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.status().model_dump_json())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[PREWARM] Could not save status for {self.job_id}: {e}")
+
+    async def _is_cached(self, item: SynthesizeRequest) -> bool:
+        spec = OUTPUT_FORMATS[resolve_format(item.format)]
+        key = synthesis_key(item.text, VOICES[item.voice]["id"], item.pinyin, spec["azure"])
+        if key in audio_cache:
+            return True
+        return audio_store is not None and await asyncio.to_thread(audio_store.contains, key)
+
+    async def _process(self, item: SynthesizeRequest) -> None:
+        try:
+            if item.voice not in VOICES:
+                raise HTTPException(status_code=400, detail=f"Unknown voice: {item.voice}")
+            if await self._is_cached(item):
+                self.skipped += 1
+                return
+            await synthesize_one(item.model_copy(update={"delivery": "url"}), batchable=True, pinned=True)
+            self.synthesized += 1
+        except HTTPException as e:
+            self.failed += 1
+            self.errors.append(f"{item.text} ({item.voice}, {item.format}): {e.detail}")
+        self._save()
+
+    async def run(self) -> None:
+        request_deadline.set(None)  # Background work, not bound by the /admin request
+        queue = iter(self.items)
+        
+        async def _worker() -> None:
+            for item in queue:
+                await self._process(item)
+        
+        print(f"[PREWARM] Job {self.job_id}: {len(self.items)} clips, concurrency {self.concurrency}")
+        workers = [asyncio.ensure_future(_worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+            self.state = "finished"
+        except asyncio.CancelledError:
+            self.state = "interrupted"
+            raise
+        except Exception as e:
+            # Terminal, so resubmitting the list starts a fresh job
+            self.state = "failed"
+            self.errors.append(f"Job failed: {e!r}")
+            print(f"[PREWARM] Job {self.job_id} crashed: {e!r}")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.finished_at = time.time()
+            self._save(force=True)
+            print(
+                f"[PREWARM] Job {self.job_id} {self.state}: {self.synthesized} synthesized, "
+                f"{self.skipped} skipped, {self.failed} failed"
+            )
+
+    def start(self) -> None:
+        self.task = asyncio.ensure_future(self.run())
+
+
+prewarm_jobs: Dict[str, PrewarmJob] = {}
+
+
+def require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    # Constant-time, on bytes so a non-ASCII header can't raise
+    if not secrets.compare_digest((token or "").encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/admin/prewarm", response_model=PrewarmStatus)
+async def start_prewarm(request: Request, x_admin_token: Optional[str] = Header(None)):
+    """
+    Start prewarming the cache from a word list (JSON or CSV body).
+    
+    Resubmitting the same list returns the running job, or resumes a
+    finished/interrupted one, skipping clips that are already cached.
+    """
+    require_admin(x_admin_token)
+    body = (await request.body()).decode("utf-8")
+    try:
+        word_list = parse_word_list(body, request.headers.get("content-type", "application/json"))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid word list: {e}")
+    
+    for format_name in word_list.formats:
+        resolve_format(format_name)
+    items = expand_word_list(word_list)
+    if not items:
+        raise HTTPException(status_code=400, detail="Word list is empty")
+    
+    job_id = prewarm_job_id(items)
+    job = prewarm_jobs.get(job_id)
+    if job is None or job.state != "running":
+        job = PrewarmJob(job_id, items, word_list.concurrency or PREWARM_CONCURRENCY)
+        prewarm_jobs[job_id] = job
+        job.start()
+    return job.status()
+
+
+@app.get("/admin/prewarm/{job_id}", response_model=PrewarmStatus)
+async def get_prewarm(job_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Progress of a prewarm job (from any worker, via the saved status)."""
+    require_admin(x_admin_token)
+    job = prewarm_jobs.get(job_id)
+    if job is not None:
+        return job.status()
+    path = PrewarmJob.status_path(job_id) if re.fullmatch(r"[0-9a-f]{16}", job_id) else None
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return PrewarmStatus.model_validate_json(f.read())
+    raise HTTPException(status_code=404, detail="Prewarm job not found")
+
+
+async def run_prewarm_cli(path: str, formats: List[str], concurrency: int) -> int:
+    """Prewarm from a word list file without running the web server."""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    content_type = "text/csv" if path.lower().endswith(".csv") else "application/json"
+    word_list = parse_word_list(content, content_type)
+    if formats:
+        word_list.formats = formats
+    for format_name in word_list.formats:
+        resolve_format(format_name)
+    items = expand_word_list(word_list)
+    
+    deck_queue.workers = 0  # Only the server processes decks
+    async with lifespan(app):
+        job = PrewarmJob(prewarm_job_id(items), items, concurrency)
+        job.start()
+        while not job.task.done():
+            await asyncio.wait({job.task}, timeout=5.0)
+            status = job.status()
+            print(
+                f"[PREWARM] {job.processed}/{status.total} "
+                f"({status.synthesized} synthesized, {status.skipped} skipped, {status.failed} failed)"
+                + (f", ETA {status.etaSeconds}s" if status.etaSeconds is not None else "")
+            )
+        await job.task
+    return 1 if job.failed or job.state != "finished" else 0
+
+
 # ═══════════════════════════════════════════════════════════
 # MAIN
 # ═══════════════════════════════════════════════════════════
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "prewarm":
+        import argparse
+        parser = argparse.ArgumentParser(prog="main.py prewarm", description="Prewarm the audio cache")
+        parser.add_argument("word_list", help="CSV (text,pinyin,voices) or JSON word list")
+        parser.add_argument("--format", dest="formats", action="append", default=[],
+                            help="Output format (repeatable, default mp3)")
+        parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+        args = parser.parse_args(sys.argv[2:])
+        sys.exit(asyncio.run(run_prewarm_cli(args.word_list, args.formats, args.concurrency)))
+    
     import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,11 @@
+"""Shared setup: import main.py with a throwaway configuration."""
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("AZURE_SPEECH_KEY", "test-subscription-key")
+os.environ.setdefault("AZURE_SPEECH_REGION", "westeurope")
+os.environ.setdefault("AUDIO_STORE_DIR", tempfile.mkdtemp(prefix="tts-test-store-"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,26 @@
+"""Admin token checks."""
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+@pytest.mark.parametrize("token", [None, "", "wrong", "secret-token-extra", "sécret"])
+def test_bad_tokens_are_rejected(monkeypatch, token):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret-token")
+    with pytest.raises(HTTPException) as info:
+        main.require_admin(token)
+    assert info.value.status_code == 401
+
+
+def test_matching_token_is_accepted(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret-token")
+    main.require_admin("secret-token")
+
+
+def test_admin_disabled_without_a_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    with pytest.raises(HTTPException) as info:
+        main.require_admin("anything")
+    assert info.value.status_code == 403
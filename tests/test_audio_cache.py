@@ -0,0 +1,85 @@
+"""W-TinyLFU admission in AudioCache and its FrequencySketch."""
+
+import pytest
+
+import main
+
+CLIP_BYTES = 1000
+
+
+def clip(key: str, size: int = CLIP_BYTES) -> main.AudioClip:
+    return main.AudioClip(key=key, data=bytes(size), output_format=main.OUTPUT_FORMATS["pcm"]["azure"])
+
+
+@pytest.fixture
+def cache():
+    # 1000-byte window, 9000-byte main cache: one clip in the window, nine in main
+    cache = main.AudioCache(10 * CLIP_BYTES, window_ratio=0.1)
+    for i in range(10):
+        cache.put(clip(f"hot-{i}"))
+    for _ in range(3):
+        for i in range(9):
+            assert cache.get(f"hot-{i}") is not None
+    return cache
+
+
+def test_sketch_counts_and_saturates():
+    sketch = main.FrequencySketch(1024)
+    for _ in range(3):
+        sketch.increment("a")
+    assert sketch.frequency("a") == 3
+    assert sketch.frequency("never-seen") == 0
+    for _ in range(50):
+        sketch.increment("a")
+    assert sketch.frequency("a") == main.FrequencySketch.MAX_COUNT
+
+
+def test_sketch_width_is_a_power_of_two():
+    assert main.FrequencySketch(1000).width == 1024
+    assert main.FrequencySketch(1).width == 16
+
+
+def test_sketch_halves_after_its_sample():
+    sketch = main.FrequencySketch(16)
+    for _ in range(8):
+        sketch.increment("a")
+    i = 0
+    while sketch.resets == 0:
+        sketch.increment(f"filler-{i}")
+        i += 1
+    assert sketch.frequency("a") == 4
+    assert sketch.additions == sketch.sample_size // 2
+
+
+def test_one_off_clip_is_turned_away(cache):
+    cache.put(clip("one-off-1"))  # Pushes hot-9 (never read) out of the window
+    assert "hot-9" not in cache
+    assert cache.rejections == 1
+    assert all(f"hot-{i}" in cache for i in range(9))
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_popular_newcomer_is_admitted(cache):
+    for _ in range(5):
+        assert cache.get("newcomer") is None  # Misses still count toward popularity
+    cache.put(clip("newcomer"))
+    cache.put(clip("one-off-1"))  # Pushes the newcomer out of the window
+    assert "newcomer" in cache
+    assert cache.evictions == 1
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_second_hit_promotes_to_protected():
+    cache = main.AudioCache(10 * CLIP_BYTES, window_ratio=0.1)
+    cache.put(clip("a"))
+    cache.put(clip("b"))  # a moves to probation
+    assert cache.stats()["protectedEntries"] == 0
+    cache.get("a")
+    assert cache.stats()["protectedEntries"] == 1
+
+
+def test_oversized_clip_is_not_cached():
+    cache = main.AudioCache(10 * CLIP_BYTES)
+    cache.put(clip("huge", size=11 * CLIP_BYTES))
+    assert "huge" not in cache
+    assert cache.current_bytes == 0
@@ -0,0 +1,79 @@
+"""Byte ranges and If-Range on /audio (clips are served from a patched cache lookup)."""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import main
+
+KEY = "a" * 64
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=50-500", (50, 99)),
+    ("BYTES = 5-5", (5, 5)),
+])
+def test_parse_range(header, expected):
+    assert main.parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "items=0-9", "bytes=0-1,5-6", "bytes=abc", "bytes=-", "bytes=5", "bytes=--5", "bytes=+1-2",
+])
+def test_unusable_ranges_mean_the_whole_clip(header):
+    assert main.parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=200-300", "bytes=9-3", "bytes=-0"])
+def test_unsatisfiable_ranges_are_416(header):
+    with pytest.raises(HTTPException) as info:
+        main.parse_range(header, 100)
+    assert info.value.status_code == 416
+    assert info.value.headers["Content-Range"] == "bytes */100"
+
+
+def get_audio(monkeypatch, **headers):
+    clip = main.AudioClip(key=KEY, data=bytes(range(100)), output_format=main.OUTPUT_FORMATS["wav"]["azure"])
+
+    async def lookup(key, output_format=None):
+        return clip if key == KEY else None
+
+    monkeypatch.setattr(main, "lookup_audio", lookup)
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": f"/audio/{KEY}.wav",
+        "query_string": b"",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    }
+    return asyncio.run(main.get_audio(KEY, "wav", Request(scope)))
+
+
+def test_range_request_is_partial(monkeypatch):
+    response = get_audio(monkeypatch, range="bytes=-10")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 90-99/100"
+    assert response.body == bytes(range(90, 100))
+
+
+def test_if_range_with_our_etag_honours_the_range(monkeypatch):
+    response = get_audio(monkeypatch, range="bytes=0-9", if_range=f'"{KEY}"')
+    assert response.status_code == 206
+    assert response.body == bytes(range(10))
+
+
+def test_stale_if_range_gets_the_whole_clip(monkeypatch):
+    response = get_audio(monkeypatch, range="bytes=0-9", if_range='"something-else"')
+    assert response.status_code == 200
+    assert len(response.body) == 100
+
+
+def test_stale_if_range_skips_the_416(monkeypatch):
+    response = get_audio(monkeypatch, range="bytes=500-", if_range="Wed, 21 Oct 2015 07:28:00 GMT")
+    assert response.status_code == 200
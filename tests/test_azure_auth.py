@@ -0,0 +1,185 @@
+"""
+Bearer token handling against a local stand-in for Azure's issueToken endpoint.
+
+The stand-in is a real HTTP server on 127.0.0.1; synthesis calls (https://)
+go to an in-process mock so no test touches Azure.
+"""
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import main
+
+
+class TokenStandIn:
+    """Minimal issueToken endpoint: returns token-1, token-2, ... or a set error status."""
+
+    def __init__(self):
+        self.keys = []
+        self.status = 200
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stand_in.keys.append(self.headers.get("Ocp-Apim-Subscription-Key"))
+                body = f"token-{len(stand_in.keys)}".encode() if stand_in.status == 200 else b"error"
+                self.send_response(stand_in.status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/sts/v1.0/issueToken"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    server = TokenStandIn()
+    monkeypatch.setattr(main, "AZURE_TOKEN_ENDPOINT", server.url)
+    monkeypatch.setattr(main, "AZURE_TOKEN_AUTH", True)
+    monkeypatch.setattr(main, "_token_managers", {})
+    yield server
+    server.close()
+
+
+def run(coro_fn, azure_handler=None):
+    """Run coro_fn() with a shared client: real HTTP to the stand-in, mocked Azure synthesis."""
+    async def _main():
+        handler = azure_handler or (lambda request: httpx.Response(200, content=b"audio"))
+        client = httpx.AsyncClient(mounts={"https://": httpx.MockTransport(handler)}, trust_env=False)
+        previous, main._http_client = main._http_client, client
+        try:
+            return await coro_fn()
+        finally:
+            main._http_client = previous
+            await client.aclose()
+    return asyncio.run(_main())
+
+
+def test_token_is_fetched_once_and_cached(stand_in):
+    manager = main.get_token_manager("test-subscription-key", "westeurope")
+
+    async def scenario():
+        first = await manager.auth_headers()
+        second = await manager.auth_headers()
+        return first, second
+
+    first, second = run(scenario)
+    assert first == second == {"Authorization": "Bearer token-1"}
+    assert stand_in.keys == ["test-subscription-key"]
+    assert manager.stats()["refreshes"] == 1
+
+
+def test_expired_token_is_refreshed(stand_in):
+    manager = main.get_token_manager("test-subscription-key", "westeurope")
+
+    async def scenario():
+        await manager.auth_headers()
+        manager._expires_at = 0.0  # Simulate the TTL running out
+        return await manager.auth_headers()
+
+    assert run(scenario) == {"Authorization": "Bearer token-2"}
+    assert len(stand_in.keys) == 2
+
+
+def test_background_refresh_keeps_old_token_until_replaced(stand_in, monkeypatch):
+    monkeypatch.setattr(main, "AZURE_TOKEN_REFRESH_SECONDS", 0.05)
+    manager = main.get_token_manager("test-subscription-key", "westeurope")
+
+    async def scenario():
+        manager.start()
+        try:
+            await asyncio.sleep(0.01)
+            assert manager.token == "token-1"
+            await asyncio.sleep(0.2)
+            return manager.token
+        finally:
+            await manager.stop()
+
+    token = run(scenario)
+    assert token not in (None, "token-1")
+    assert manager.refreshes >= 2
+
+
+def test_falls_back_to_subscription_key_when_token_endpoint_fails(stand_in):
+    stand_in.status = 500
+    manager = main.get_token_manager("test-subscription-key", "westeurope")
+
+    headers = run(manager.auth_headers)
+    assert headers == {"Ocp-Apim-Subscription-Key": "test-subscription-key"}
+    assert manager.failures == 1
+
+
+def test_token_auth_disabled_uses_subscription_key(stand_in, monkeypatch):
+    monkeypatch.setattr(main, "AZURE_TOKEN_AUTH", False)
+    manager = main.get_token_manager("test-subscription-key", "westeurope")
+
+    headers = run(manager.auth_headers)
+    assert headers == {"Ocp-Apim-Subscription-Key": "test-subscription-key"}
+    assert stand_in.keys == []
+
+
+def test_401_invalidates_token_and_retry_succeeds(stand_in, monkeypatch):
+    monkeypatch.setattr(main, "AZURE_RETRY_BASE_MS", 1.0)
+    monkeypatch.setattr(main, "AZURE_RETRY_MAX_MS", 5.0)
+    seen = []
+
+    def azure(request):
+        seen.append(request.headers.get("Authorization") or "key:" + request.headers["Ocp-Apim-Subscription-Key"])
+        if request.headers.get("Authorization") == "Bearer token-1":
+            return httpx.Response(401, text="token expired")
+        return httpx.Response(200, content=b"audio")
+
+    async def scenario():
+        manager = main.get_token_manager("test-subscription-key", "westeurope")
+        await manager.refresh()
+        response = await main.send_with_retries("<speak/>", main.DEFAULT_OUTPUT_FORMAT)
+        return response, manager
+
+    response, manager = run(scenario, azure)
+    assert response.status_code == 200
+    assert seen[0] == "Bearer token-1"
+    # The rejected token was dropped and the retry authenticated afresh
+    assert seen[1] == "Bearer token-2"
+    assert manager.token == "token-2"
+
+
+def test_401_with_background_refresher_retries_with_subscription_key(stand_in, monkeypatch):
+    monkeypatch.setattr(main, "AZURE_RETRY_BASE_MS", 1.0)
+    monkeypatch.setattr(main, "AZURE_RETRY_MAX_MS", 5.0)
+    seen = []
+
+    def azure(request):
+        seen.append(request.headers.get("Authorization") or "key:" + request.headers["Ocp-Apim-Subscription-Key"])
+        if request.headers.get("Authorization"):
+            return httpx.Response(401, text="token expired")
+        return httpx.Response(200, content=b"audio")
+
+    async def scenario():
+        manager = main.get_token_manager("test-subscription-key", "westeurope")
+        manager.start()
+        try:
+            for _ in range(100):
+                if manager.token is not None:
+                    break
+                await asyncio.sleep(0.01)
+            return await main.send_with_retries("<speak/>", main.DEFAULT_OUTPUT_FORMAT)
+        finally:
+            await manager.stop()
+
+    response = run(scenario, azure)
+    assert response.status_code == 200
+    assert seen == ["Bearer token-1", "key:test-subscription-key"]
@@ -0,0 +1,43 @@
+"""Streamed JSON envelope of /synthesize/batch (Azure is mocked)."""
+
+import base64
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+AUDIO = b"\xff\xf3" + bytes(range(256)) * 400
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def azure(request):
+        return httpx.Response(200, content=AUDIO)
+
+    monkeypatch.setattr(main, "AZURE_TOKEN_AUTH", False)
+    monkeypatch.setattr(main, "MICROBATCH_ENABLED", False)
+    monkeypatch.setattr(main, "create_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(azure)))
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def test_batch_streams_valid_json_with_inline_audio(client):
+    response = client.post("/synthesize/batch", json={"items": [
+        {"text": "批一"},
+        {"text": "批一"},
+        {"text": "批二", "delivery": "url"},
+        {"text": ""},
+    ]})
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
+    body = json.loads(response.content)
+    first, duplicate, url, bad = body["results"]
+    assert base64.b64decode(first["result"]["audioBase64"]) == AUDIO
+    assert duplicate["result"]["audioBase64"] == first["result"]["audioBase64"]
+    assert duplicate["result"]["charactersUsed"] == 0
+    assert url["result"]["audioBase64"] is None and url["result"]["audioUrl"].endswith(".mp3")
+    assert bad == {"index": 3, "status": 400, "error": "Text is required", "result": None}
+    assert body["charactersUsed"] == 4
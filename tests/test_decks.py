@@ -0,0 +1,116 @@
+"""Deck queue robustness (synthesis is mocked, the queue uses a temp SQLite file)."""
+
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return main.DeckQueue(str(tmp_path / "decks.sqlite3"), workers=1)
+
+
+def test_submit_rejects_unknown_voice():
+    request = main.DeckRequest(items=[main.SynthesizeRequest(text="你好", voice="bad")])
+    with pytest.raises(HTTPException) as info:
+        asyncio.run(main.submit_deck(request))
+    assert info.value.status_code == 400
+
+
+def test_worker_survives_unexpected_errors(queue, monkeypatch):
+    calls = []
+
+    async def flaky(text, voice_id, pinyin, output_format, batchable=False, pinned=False):
+        calls.append(text)
+        if text == "坏":
+            raise RuntimeError("boom")
+        return main.AudioClip(key="k" * 64, data=b"audio", output_format=output_format), True
+
+    monkeypatch.setattr(main, "get_or_synthesize", flaky)
+    monkeypatch.setattr(main, "DECK_MAX_ATTEMPTS", 1)
+
+    async def scenario():
+        await queue.start()
+        try:
+            deck_id = await queue.submit("t", [
+                main.SynthesizeRequest(text="坏", format="mp3"),
+                main.SynthesizeRequest(text="好", format="mp3"),
+            ])
+            for _ in range(50):
+                status = await queue.status(deck_id)
+                if status.state == "finished":
+                    return status
+                await asyncio.sleep(0.1)
+            return status
+        finally:
+            await queue.stop()
+
+    status = asyncio.run(scenario())
+    assert status.state == "finished"
+    assert (status.done, status.failed) == (1, 1)
+    assert calls == ["坏", "好"]
+
+
+def test_deadline_errors_are_retried(queue, monkeypatch):
+    calls = []
+
+    async def deadline_then_ok(text, voice_id, pinyin, output_format, batchable=False, pinned=False):
+        calls.append(text)
+        if len(calls) == 1:
+            raise main.DeadlineExceeded()
+        return main.AudioClip(key="k" * 64, data=b"audio", output_format=output_format), True
+
+    monkeypatch.setattr(main, "get_or_synthesize", deadline_then_ok)
+    monkeypatch.setattr(main, "DECK_MAX_ATTEMPTS", 2)
+
+    async def scenario():
+        await queue.start()
+        try:
+            deck_id = await queue.submit("t", [main.SynthesizeRequest(text="好", format="mp3")])
+            for _ in range(50):
+                status = await queue.status(deck_id)
+                if status.state == "finished":
+                    return status
+                await asyncio.sleep(0.1)
+            return status
+        finally:
+            await queue.stop()
+
+    status = asyncio.run(scenario())
+    assert (status.done, status.failed) == (1, 0)
+    assert calls == ["好", "好"]
+
+
+def test_pinned_joiner_does_not_inherit_a_deadline(monkeypatch):
+    calls = []
+
+    async def fetch(ssml, output_format):
+        calls.append(main.request_deadline.get())
+        await asyncio.sleep(0.05)
+        if main.request_deadline.get() is not None:
+            raise main.DeadlineExceeded()
+        return b"audio"
+
+    monkeypatch.setattr(main, "fetch_from_azure", fetch)
+    spec = main.OUTPUT_FORMATS["mp3"]["azure"]
+    voice_id = main.VOICES[next(iter(main.VOICES))]["id"]
+
+    async def interactive():
+        main.request_deadline.set(time.monotonic() + 0.01)
+        return await main.get_or_synthesize("截止", voice_id, None, spec)
+
+    async def scenario():
+        leader = asyncio.ensure_future(interactive())
+        await asyncio.sleep(0)
+        joiner = main.get_or_synthesize("截止", voice_id, None, spec, pinned=True)
+        return await asyncio.gather(leader, joiner, return_exceptions=True)
+
+    leader, joiner = asyncio.run(scenario())
+    assert isinstance(leader, main.DeadlineExceeded)
+    clip, fresh = joiner
+    assert clip.data == b"audio" and fresh
+    assert len(calls) == 2 and calls[1] is None
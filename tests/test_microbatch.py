@@ -0,0 +1,106 @@
+"""Micro-batching: silence-based splitting and failure handling (Azure is mocked)."""
+
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import main
+
+RATE = 16000
+PCM_FORMAT = "raw-16khz-16bit-mono-pcm"
+WAV_FORMAT = "riff-16khz-16bit-mono-pcm"
+
+
+def words_with_gaps(word_seconds, gap_seconds):
+    """Float samples: tone bursts separated by digital silence."""
+    tone = lambda seconds: 0.3 * np.sin(np.arange(int(seconds * RATE)) * 0.2)
+    parts = []
+    for i, seconds in enumerate(word_seconds):
+        if i:
+            parts.append(np.zeros(int(gap_seconds * RATE)))
+        parts.append(tone(seconds))
+    return np.concatenate(parts).astype(np.float32)
+
+
+def to_pcm(samples):
+    return (samples * 32767).astype("<i2").tobytes()
+
+
+def test_find_word_gaps_returns_gap_centres():
+    samples = words_with_gaps([0.5, 0.3, 0.4], 0.4)
+    gaps = main.find_word_gaps(samples, RATE, 3, min_gap_seconds=0.24)
+    assert gaps == pytest.approx([0.7, 1.4], abs=0.02)
+
+
+def test_find_word_gaps_rejects_ambiguous_counts():
+    samples = words_with_gaps([0.5, 0.3, 0.4], 0.4)
+    assert main.find_word_gaps(samples, RATE, 2, min_gap_seconds=0.24) is None
+    # Short pauses inside a word don't count as gaps
+    assert main.find_word_gaps(samples, RATE, 1, min_gap_seconds=0.5) == []
+    assert main.find_word_gaps(np.zeros(RATE, dtype=np.float32), RATE, 2, min_gap_seconds=0.24) is None
+
+
+def test_split_raw_pcm_on_sample_boundaries():
+    data = to_pcm(words_with_gaps([0.5, 0.3], 0.4))
+    clips = main.split_batch_audio(data, PCM_FORMAT, 2, break_ms=400)
+    assert clips is not None and len(clips) == 2
+    assert b"".join(clips) == data
+    assert all(len(clip) % 2 == 0 for clip in clips)
+    assert len(clips[0]) / 2 / RATE == pytest.approx(0.7, abs=0.02)
+
+
+def test_split_wav_rewraps_each_word():
+    data = main._wav_bytes(to_pcm(words_with_gaps([0.5, 0.3, 0.2], 0.4)), 1, 2, RATE)
+    clips = main.split_batch_audio(data, WAV_FORMAT, 3, break_ms=400)
+    assert clips is not None and len(clips) == 3
+    assert all(clip[:4] == b"RIFF" for clip in clips)
+
+
+def test_split_gives_up_on_wrong_word_count_and_opus():
+    data = to_pcm(words_with_gaps([0.5, 0.3], 0.4))
+    assert main.split_batch_audio(data, PCM_FORMAT, 3, break_ms=400) is None
+    assert main.split_batch_audio(b"OggS", "ogg-24khz-16bit-mono-opus", 2, break_ms=400) is None
+
+
+def test_crashing_split_still_resolves_every_waiter(monkeypatch):
+    async def fake_fetch(ssml, output_format):
+        return b"audio"
+
+    def broken_split(*args):
+        raise ValueError("bad audio")
+
+    monkeypatch.setattr(main, "fetch_from_azure", fake_fetch)
+    monkeypatch.setattr(main, "split_batch_audio", broken_split)
+
+    async def scenario():
+        batcher = main.MicroBatcher(window_ms=5, max_words=16, max_chars=300, break_ms=400)
+        results = await asyncio.wait_for(asyncio.gather(
+            batcher.synthesize("一", "voice", PCM_FORMAT, "<speak>一</speak>"),
+            batcher.synthesize("二", "voice", PCM_FORMAT, "<speak>二</speak>"),
+        ), timeout=2)
+        return batcher, results
+
+    batcher, results = asyncio.run(scenario())
+    # The split failure falls back to one request per word
+    assert results == [b"audio", b"audio"]
+    assert batcher.fallbacks == 1
+
+
+def test_unexpected_error_fails_waiters_instead_of_hanging(monkeypatch):
+    async def scenario():
+        batcher = main.MicroBatcher(window_ms=5, max_words=16, max_chars=300, break_ms=400)
+
+        async def exploding(group, items):
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(batcher, "_synthesize_group", exploding)
+        return await asyncio.wait_for(asyncio.gather(
+            batcher.synthesize("一", "voice", PCM_FORMAT, "<speak>一</speak>"),
+            batcher.synthesize("二", "voice", PCM_FORMAT, "<speak>二</speak>"),
+            return_exceptions=True,
+        ), timeout=2)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, HTTPException) and r.status_code == 500 for r in results)
@@ -0,0 +1,115 @@
+"""MP3 frame parsing, the ?t= seek index and header-based clip durations (synthetic audio, nothing decoded)."""
+
+import io
+import math
+import wave
+
+import pytest
+
+import main
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417 bytes per frame (418 padded)
+MPEG1_HEADER = b"\xff\xfb\x90\x00"
+# MPEG-2 Layer III, 64 kbps, 22.05 kHz: 208 bytes per frame
+MPEG2_HEADER = b"\xff\xf3\x80\x00"
+
+
+def frame(header: bytes = MPEG1_HEADER) -> bytes:
+    size = main.parse_mp3_frame_header(header, 0).size
+    return header + bytes(size - 4)
+
+
+def mp3_clip(data: bytes) -> main.AudioClip:
+    return main.AudioClip(key="k" * 64, data=data, output_format=main.OUTPUT_FORMATS["mp3"]["azure"])
+
+
+def test_mpeg1_header():
+    parsed = main.parse_mp3_frame_header(MPEG1_HEADER, 0)
+    assert (parsed.size, parsed.bitrate, parsed.sample_rate, parsed.samples) == (417, 128, 44100, 1152)
+
+
+def test_padding_adds_a_byte():
+    assert main.parse_mp3_frame_header(b"\xff\xfb\x92\x00", 0).size == 418
+
+
+def test_mpeg2_header():
+    parsed = main.parse_mp3_frame_header(MPEG2_HEADER, 0)
+    assert (parsed.size, parsed.bitrate, parsed.sample_rate, parsed.samples) == (208, 64, 22050, 576)
+
+
+@pytest.mark.parametrize("header", [
+    b"\x00\xfb\x90\x00",  # No sync
+    b"\xff\xfd\x90\x00",  # Layer II
+    b"\xff\xeb\x90\x00",  # Reserved version
+    b"\xff\xfb\xf0\x00",  # Bad bitrate index
+    b"\xff\xfb\x0c\x00",  # Free-format bitrate, reserved sample rate
+    b"\xff\xfb\x90",  # Truncated
+])
+def test_rejects_non_frames(header):
+    assert main.parse_mp3_frame_header(header, 0) is None
+
+
+def test_frames_skip_id3_and_junk_and_drop_a_truncated_tail():
+    id3 = b"ID3\x04\x00\x00\x00\x00\x00\x05" + bytes(5)
+    data = id3 + frame() + b"junk" + frame() + frame()[:100]
+    frames = main.parse_mp3_frames(data)
+    assert [f.offset for f in frames] == [15, 15 + 417 + 4]
+
+
+def test_mp3_duration_bitrate_and_index():
+    clip = mp3_clip(frame() * 10)
+    clip.analyze()
+    assert clip.frame_count == 10
+    assert clip.duration_ms == round(10 * 1152 / 44100 * 1000)
+    assert clip.bitrate == 128
+    assert list(clip.frame_offsets) == [417 * i for i in range(10)]
+
+
+def test_offset_at_finds_the_playing_frame():
+    clip = mp3_clip(frame() * 10)
+    clip.analyze()
+    per_frame = 1152 / 44100
+    assert clip.offset_at(0.0) == 0
+    assert clip.offset_at(3.5 * per_frame) == 3 * 417
+    assert clip.offset_at(9.99 * per_frame) == 9 * 417
+
+
+@pytest.mark.parametrize("seconds", [10 * 1152 / 44100, 60.0, 1e308, math.inf, math.nan])
+def test_offset_at_past_the_end(seconds):
+    clip = mp3_clip(frame() * 10)
+    clip.analyze()
+    assert clip.offset_at(seconds) is None
+
+
+def test_offset_at_without_frames():
+    clip = mp3_clip(b"not audio")
+    clip.analyze()
+    assert clip.frame_count == 0 and clip.duration_ms is None
+    assert clip.offset_at(0.0) is None
+
+
+def test_wav_duration():
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(bytes(2 * 8000))
+    clip = main.AudioClip(key="k" * 64, data=buffer.getvalue(), output_format=main.OUTPUT_FORMATS["wav"]["azure"])
+    clip.analyze()
+    assert (clip.duration_ms, clip.bitrate) == (500, 256)
+
+
+def test_pcm_duration():
+    clip = main.AudioClip(key="k" * 64, data=bytes(2 * 4000), output_format=main.OUTPUT_FORMATS["pcm"]["azure"])
+    clip.analyze()
+    assert (clip.duration_ms, clip.bitrate) == (250, 256)
+
+
+def test_ogg_opus_duration():
+    pre_skip = 312
+    head = b"OggS" + bytes(2) + bytes(8) + bytes(14) + b"OpusHead\x01\x01" + pre_skip.to_bytes(2, "little") + bytes(8)
+    last = b"OggS" + bytes(2) + (48000 + pre_skip).to_bytes(8, "little") + bytes(20)
+    clip = main.AudioClip(key="k" * 64, data=head + last, output_format=main.OUTPUT_FORMATS["opus-16k"]["azure"])
+    clip.analyze()
+    assert clip.duration_ms == 1000
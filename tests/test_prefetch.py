@@ -0,0 +1,28 @@
+"""Prefetch fan-out (synthesis is mocked)."""
+
+import asyncio
+
+import main
+
+
+def test_prefetch_runs_items_concurrently(monkeypatch):
+    in_flight = []
+    peak = []
+
+    async def fake_synthesize(item, batchable=False, pinned=False):
+        in_flight.append(item.text)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.remove(item.text)
+
+    monkeypatch.setattr(main, "synthesize_one", fake_synthesize)
+
+    async def scenario():
+        prefetcher = main.Prefetcher(concurrency=4, rate=100)
+        items = [main.SynthesizeRequest(text=f"词{i}") for i in range(8)]
+        await prefetcher._run(items)
+        return prefetcher
+
+    prefetcher = asyncio.run(scenario())
+    assert prefetcher.synthesized == 8
+    assert max(peak) == 4
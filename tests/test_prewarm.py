@@ -0,0 +1,22 @@
+"""Prewarm job lifecycle (synthesis is mocked)."""
+
+import asyncio
+
+import main
+
+
+def test_unexpected_error_marks_job_failed(monkeypatch):
+    async def broken(item):
+        raise RuntimeError("disk on fire")
+
+    async def scenario():
+        job = main.PrewarmJob("0" * 16, [main.SynthesizeRequest(text="热")], concurrency=2)
+        monkeypatch.setattr(job, "_process", broken)
+        job.start()
+        await job.task
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == "failed"
+    assert job.status().state == "failed"
+    assert "disk on fire" in job.errors[-1]
@@ -0,0 +1,63 @@
+"""Multi-region routing and failover (Azure is mocked per region)."""
+
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def regions(monkeypatch):
+    monkeypatch.setattr(main, "_region_router", main.RegionRouter([("key", "a"), ("key", "b")]))
+    monkeypatch.setattr(main, "AZURE_TOKEN_AUTH", False)
+    monkeypatch.setattr(main, "AZURE_RETRY_BASE_MS", 1.0)
+    monkeypatch.setattr(main, "AZURE_RETRY_MAX_MS", 5.0)
+    monkeypatch.setattr(main, "azure_circuit", main.CircuitBreaker(failure_threshold=100, open_seconds=30))
+    return main._region_router
+
+
+def run_requests(count, statuses):
+    seen = []
+
+    def azure(request):
+        region = request.url.host.split(".")[0]
+        seen.append(region)
+        return httpx.Response(statuses.get(region, 200), content=b"audio")
+
+    async def _main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(azure))
+        previous, main._http_client = main._http_client, client
+        try:
+            return [(await main.send_with_retries("<speak/>", main.DEFAULT_OUTPUT_FORMAT)).status_code
+                    for _ in range(count)]
+        finally:
+            main._http_client = previous
+            await client.aclose()
+
+    return asyncio.run(_main()), "".join(seen)
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_rejecting_region_fails_over_and_stops_being_chosen(regions, status):
+    results, seen = run_requests(4, {"a": status})
+    assert results == [200] * 4
+    # Only the first request pays for region a
+    assert seen == "abbbb"
+    assert regions.regions[0].failures == 1
+
+
+def test_unmeasured_region_with_errors_ranks_behind_known_good(regions):
+    a, b = regions.regions
+    b.ewma_latency = 0.2
+    assert regions.choose() is a  # Clean and unmeasured: ties with the best, wins on order
+    a.ewma_error = 0.2
+    assert regions.choose() is b
+
+
+def test_repeated_rejections_demote_the_region(regions):
+    a = regions.regions[0]
+    for _ in range(main.REGION_DEMOTE_FAILURES):
+        regions.record_failure(a)
+    assert a.demoted
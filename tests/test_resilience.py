@@ -0,0 +1,69 @@
+"""Adaptive limiter reactions to upstream Azure responses (synthesis is mocked)."""
+
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    fresh = main.AdaptiveLimiter(initial=8, min_limit=1, max_limit=16, max_queue=10, queue_timeout=1.0)
+    monkeypatch.setattr(main, "azure_limiter", fresh)
+    monkeypatch.setattr(main, "AZURE_TOKEN_AUTH", False)
+    return fresh
+
+
+def send_once(status: int) -> main.AzureError:
+    async def _main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status, text="busy")))
+        previous, main._http_client = main._http_client, client
+        try:
+            await main.send_to_azure("<speak/>", main.DEFAULT_OUTPUT_FORMAT)
+        except main.AzureError as e:
+            return e
+        finally:
+            main._http_client = previous
+            await client.aclose()
+    return asyncio.run(_main())
+
+
+@pytest.mark.parametrize("status", [429, 503, 504])
+def test_overload_statuses_shrink_the_limit(limiter, status):
+    error = send_once(status)
+    assert error.overload
+    assert limiter.limit < 8
+
+
+@pytest.mark.parametrize("status", [400, 500])
+def test_other_errors_leave_the_limit_alone(limiter, status):
+    error = send_once(status)
+    assert not error.overload
+    assert limiter.limit == 8
+
+
+def test_stream_holds_its_slot_until_closed(limiter):
+    async def _main():
+        async def body():
+            yield b"au"
+            yield b"dio"
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, content=body())
+        ))
+        previous, main._http_client = main._http_client, client
+        try:
+            response, _ = await main.send_to_azure("<speak/>", main.DEFAULT_OUTPUT_FORMAT, stream=True)
+            during = limiter.in_flight
+            body = b"".join([chunk async for chunk in response.aiter_bytes()])
+            await response.aclose()
+            return during, body
+        finally:
+            main._http_client = previous
+            await client.aclose()
+
+    during, body = asyncio.run(_main())
+    assert (during, body) == (1, b"audio")
+    assert limiter.in_flight == 0